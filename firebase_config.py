@@ -44,3 +44,30 @@ def send_push_notification(token, title, body, data=None):
     except Exception as e:
         print(f"❌ Error sending push notification: {e}")
         return False
+
+
+# FCM accepts at most 500 tokens per multicast request
+FCM_MULTICAST_LIMIT = 500
+
+
+def send_multicast_notification(tokens, title, body, data=None):
+    """Send one FCM push to up to FCM_MULTICAST_LIMIT tokens; returns the success count"""
+
+    if not firebase_admin._apps:
+        print("⚠️ Firebase not initialized — cannot send notification")
+        return 0
+
+    try:
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(title=title, body=body),
+            tokens=list(tokens),
+            data=data or {}
+        )
+
+        response = messaging.send_each_for_multicast(message)
+        print(f"📨 Multicast sent: {response.success_count} ok, {response.failure_count} failed")
+        return response.success_count
+
+    except Exception as e:
+        print(f"❌ Error sending multicast notification: {e}")
+        return 0
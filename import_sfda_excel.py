@@ -8,6 +8,7 @@ import os
 from dotenv import load_dotenv
 import uuid
 from datetime import datetime, timezone
+from sfda_search_index import ensure_sfda_search_text_index
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -78,6 +79,9 @@ async def import_medications():
             "manufacturer_ar": safe_str(row.get('اسم الشركة المصنعة', '')),
             "created_at": datetime.now(timezone.utc).isoformat()
         }
+        # Lowercased copies used by the API's prefix search
+        for field in ["commercial_name_en", "scientific_name", "manufacturer"]:
+            medication[f"{field}_lower"] = medication[field].lower()
         
         medications.append(medication)
         
@@ -94,7 +98,8 @@ async def import_medications():
     
     # Create indexes for search
     print("📇 Creating indexes for search optimization...")
-    await db.medications.create_index([("commercial_name_en", "text"), ("commercial_name_ar", "text"), ("scientific_name", "text")])
+    # Same weighted text index the API creates on startup (a collection can only have one text index)
+    await ensure_sfda_search_text_index(db.medications)
     print("✅ Indexes created")
     
     # Verify count
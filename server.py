@@ -1,20 +1,31 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Header, Request
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Header, Request, Response, BackgroundTasks, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, ReturnDocument, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
-import json
+import orjson
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Final, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from decimal import Decimal
 import base64
 import hashlib
+import math
 import random
 import re
+import unicodedata
+from string import Template
+from functools import lru_cache
+from collections import defaultdict
+from cachetools import TTLCache
+from sfda_search_index import ensure_sfda_search_text_index
 
 # OpenAI for AI features
 from openai import AsyncOpenAI
@@ -23,10 +34,11 @@ import jwt
 from PIL import Image
 import io
 import asyncio
+import httpx
 
 # Import Firebase for push notifications
 try:
-    from firebase_config import send_push_notification
+    from firebase_config import send_push_notification, send_multicast_notification, FCM_MULTICAST_LIMIT
     FIREBASE_ENABLED = True
 except Exception as e:
     print(f"⚠️ Firebase not available: {e}")
@@ -66,9 +78,23 @@ except Exception as e:
 
 # MongoDB connection
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware: BSON dates come back as UTC-aware datetimes and serialize with their +00:00 offset.
+# The pool is sized for broadcast/stats bursts: a warm minimum avoids reconnects after idle periods,
+# and a bounded wait fails fast instead of stalling requests when it is exhausted.
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    maxPoolSize=200,
+    minPoolSize=20,
+    waitQueueTimeoutMS=5000,
+    maxIdleTimeMS=30000
+)
 db = client[os.environ.get('DB_NAME', 'pharmapal_db')]
 
+# Cap concurrent OpenAI calls so request bursts don't trigger 429s and retry storms
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', '16'))
+openai_semaphore = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+
 # JWT Secret - must be set in production
 JWT_SECRET = os.environ.get('JWT_SECRET')
 if not JWT_SECRET:
@@ -78,7 +104,8 @@ if not JWT_SECRET:
 JWT_ALGORITHM = "HS256"
 
 # Create the main app without a prefix
-app = FastAPI()
+# ORJSONResponse serializes responses much faster than the stdlib json encoder
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -181,6 +208,223 @@ async def init_sfda_database():
         logging.info("SFDA mock database initialized")
 
 
+def normalize_generic_name(name: str) -> str:
+    """Normalize a generic name for equality lookups: lowercase, trimmed, diacritics removed"""
+    decomposed = unicodedata.normalize('NFKD', (name or "").lower().strip())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+# Bumped whenever normalize_generic_name changes; version 2 strips diacritics (imports stored lower().strip())
+DRUG_GUIDE_GENERIC_LOWER_VERSION = 2
+
+async def backfill_drug_guide_generic_lower():
+    """Store the current normalized generic name on Drug Guide entries normalized by an older version (or never)"""
+    updates = []
+    async for entry in db.drug_guide.find(
+        {"generic_lower_v": {"$ne": DRUG_GUIDE_GENERIC_LOWER_VERSION}},
+        {"_id": 1, "generic": 1}
+    ):
+        updates.append(UpdateOne(
+            {"_id": entry["_id"]},
+            {"$set": {
+                "generic_lower": normalize_generic_name(entry.get("generic", "")),
+                "generic_lower_v": DRUG_GUIDE_GENERIC_LOWER_VERSION
+            }}
+        ))
+    if updates:
+        await db.drug_guide.bulk_write(updates, ordered=False)
+        logging.info(f"Backfilled generic_lower on {len(updates)} Drug Guide entries")
+
+# Prefix-search fallback: Latin fields are matched through lowercased *_lower copies and Arabic
+# fields (no letter case) as stored, so every clause is a case-sensitive ^prefix index range scan
+SFDA_SEARCH_LATIN_FIELDS = ["trade_name", "commercial_name_en", "scientific_name", "active_ingredients", "manufacturer"]
+SFDA_SEARCH_ARABIC_FIELDS = ["trade_name_ar", "commercial_name_ar", "scientific_name_ar", "manufacturer_ar"]
+# Tashkeel and tatweel are stripped from queries; any Arabic letter routes the query to the Arabic fields
+ARABIC_DIACRITICS_RE = re.compile(r'[\u064B-\u0652\u0640]')
+ARABIC_LETTER_RE = re.compile(r'[\u0600-\u06FF]')
+# Search results leave out the internal lowercase shadow fields
+SFDA_SEARCH_RESULT_PROJECTION = {"_id": 0, **{f"{field}_lower": 0 for field in SFDA_SEARCH_LATIN_FIELDS}}
+
+async def ensure_sfda_search_prefix_indexes():
+    """Backfill the lowercased search fields on medications and index every prefix-search field"""
+    for field in SFDA_SEARCH_LATIN_FIELDS:
+        await db.medications.update_many(
+            {f"{field}_lower": {"$exists": False}, field: {"$type": "string"}},
+            [{"$set": {f"{field}_lower": {"$toLower": f"${field}"}}}]
+        )
+        await db.medications.create_index(f"{field}_lower")
+    for field in SFDA_SEARCH_ARABIC_FIELDS:
+        await db.medications.create_index(field)
+
+# Dosage form classes for sfda_medications.dosage_form_class, first match wins; anything else is "oral"
+DOSAGE_FORM_CLASS_PATTERNS = {
+    "topical": "cream|ointment|gel|كريم|مرهم",
+    "liquid": "syrup|suspension|solution|drops|شراب|معلق|محلول|قطرة",
+}
+DOSAGE_FORM_CLASS_RES = {form_class: re.compile(pattern, re.IGNORECASE) for form_class, pattern in DOSAGE_FORM_CLASS_PATTERNS.items()}
+
+def classify_dosage_form(dosage_form: str) -> str:
+    """Classify a dosage form (or drug name) as topical, liquid or oral"""
+    return next(
+        (form_class for form_class, pattern in DOSAGE_FORM_CLASS_RES.items() if pattern.search(dosage_form)),
+        "oral"
+    )
+
+async def backfill_sfda_dosage_form_class(collection):
+    """Store dosage_form_class on SFDA entries that have a dosage form but no class yet"""
+    unclassified = {"dosage_form_class": {"$exists": False}, "dosage_form": {"$type": "string", "$ne": ""}}
+    for form_class, pattern in DOSAGE_FORM_CLASS_PATTERNS.items():
+        await collection.update_many(
+            {**unclassified, "dosage_form": {"$regex": pattern, "$options": "i"}},
+            {"$set": {"dosage_form_class": form_class}}
+        )
+    await collection.update_many(unclassified, {"$set": {"dosage_form_class": "oral"}})
+
+async def backfill_sfda_search_tokens(collection):
+    """Store search_tokens ([trade_name_lower, active_ingredients_lower], blanks dropped) on SFDA entries missing it"""
+    await collection.update_many(
+        {"search_tokens": {"$exists": False}},
+        [{"$set": {"search_tokens": {"$setDifference": [["$trade_name_lower", "$active_ingredients_lower"], [None, ""]]}}}]
+    )
+
+# Indexes on sfda_medications, also built on the staging collection an SFDA upload swaps in
+SFDA_MEDICATION_INDEXES = [
+    "trade_name_lower",
+    "active_ingredients_lower",
+    [("trade_name_lower", 1), ("active_ingredients_lower", 1)],
+    "dosage_form_class",
+    "search_tokens",
+    "manufacturer",
+]
+
+async def ensure_sfda_medication_indexes(collection):
+    """Backfill the derived SFDA fields and create every SFDA index on the given collection"""
+    await backfill_sfda_dosage_form_class(collection)
+    await backfill_sfda_search_tokens(collection)
+    for keys in SFDA_MEDICATION_INDEXES:
+        await collection.create_index(keys)
+
+async def migrate_user_created_at_dates():
+    """Convert users.created_at stored as ISO strings to BSON dates (unparsable values are left as-is)"""
+    await db.users.update_many(
+        {"created_at": {"$type": "string"}},
+        [{"$set": {"created_at": {"$dateFromString": {"dateString": "$created_at", "onError": "$created_at"}}}}]
+    )
+
+async def ensure_indexes():
+    """Create indexes used by hot query paths (no-op if they already exist)"""
+    try:
+        await ensure_sfda_medication_indexes(db.sfda_medications)
+        await backfill_drug_guide_generic_lower()
+        await db.drug_guide.create_index("generic_lower")
+        await db.user_medications.create_index([("user_id", 1), ("id", 1), ("active", 1)])
+        await db.medication_reminders.create_index([("user_id", 1), ("enabled", 1)])
+        await db.medication_reminders.create_index([("user_id", 1), ("created_at", 1)])
+        await backfill_user_reminder_counts()
+        await migrate_user_created_at_dates()
+        # Admin dashboard and list queries: created_at (growth, recent counts, newest-first pages),
+        # is_premium + created_at (premium/free counts and filtered pages), full_name (user search);
+        # email is indexed by ensure_unique_user_email_index
+        await db.users.create_index("created_at")
+        await db.users.create_index([("is_premium", 1), ("created_at", -1)])
+        await db.users.create_index("full_name")
+        await db.user_medications.create_index([("user_id", 1), ("active", 1)])
+        await db.user_medications.create_index([("user_id", 1), ("medication_id", 1)])
+        # Paged medication lists: filter, then the stable (created_at, id) order
+        await db.user_medications.create_index([("user_id", 1), ("active", 1), ("created_at", 1), ("id", 1)])
+        await db.user_medications.create_index([("user_id", 1), ("archived", 1), ("created_at", 1), ("id", 1)])
+        await db.user_medications.create_index([("created_at", -1)])
+        await db.contact_messages.create_index([("created_at", -1)])
+        # Background contact email delivery updates its message by id
+        await db.contact_messages.create_index("id")
+        # Support tickets: status / category filters, newest first
+        await db.support_tickets.create_index([("status", 1), ("category", 1), ("created_at", -1)])
+        await db.fcm_tokens.create_index("user_id")
+        await db.notifications.create_index("user_id")
+        # Notification stats: read/unread counts and the newest-first recent list
+        await db.notifications.create_index("read")
+        await db.notifications.create_index([("created_at", -1)])
+        await db.notifications.create_index([("user_id", 1), ("read", 1)])
+        await ensure_sfda_search_text_index(db.medications)
+        await ensure_sfda_search_prefix_indexes()
+    except Exception as e:
+        logging.error(f"Error creating indexes: {e}")
+    
+    # Separate so legacy data that blocks a unique index can't skip the indexes above
+    await ensure_unique_reminder_index()
+    await ensure_unique_user_email_index()
+
+async def ensure_unique_user_email_index():
+    """Unique email among users that have one (phone-only users have none); also serves user search"""
+    try:
+        # Replace the earlier non-unique email index
+        indexes = await db.users.index_information()
+        for name, info in indexes.items():
+            if info["key"] == [("email", 1)] and not info.get("unique"):
+                await db.users.drop_index(name)
+        try:
+            await db.users.create_index(
+                "email",
+                unique=True,
+                partialFilterExpression={"email": {"$type": "string"}}
+            )
+        except DuplicateKeyError:
+            # Existing duplicate emails: keep a plain index for user search until they are resolved
+            await db.users.create_index("email")
+            raise
+    except Exception as e:
+        logging.error(f"Error creating unique user email index: {e}")
+
+# Set once the unique (user_id, medication_id) reminder index exists; until then writes check for duplicates first
+reminder_unique_index_ready = False
+REMINDER_UNIQUE_INDEX_KEYS = [("user_id", 1), ("medication_id", 1)]
+
+async def dedupe_medication_reminders():
+    """Delete all but the oldest reminder per (user, medication) so the unique index can be built"""
+    duplicates = db.medication_reminders.aggregate([
+        {"$match": {"medication_id": {"$type": "string"}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "medication_id": "$medication_id"},
+            "reminders": {"$push": {"_id": "$_id", "enabled": "$enabled"}}
+        }},
+        {"$match": {"reminders.1": {"$exists": True}}}
+    ], allowDiskUse=True)
+    
+    extra_ids = []
+    deleted_enabled_user_ids = []
+    async for group in duplicates:
+        for reminder in group["reminders"][1:]:
+            extra_ids.append(reminder["_id"])
+            if is_reminder_enabled(reminder):
+                deleted_enabled_user_ids.append(group["_id"]["user_id"])
+    if not extra_ids:
+        return
+    
+    await db.medication_reminders.delete_many({"_id": {"$in": extra_ids}})
+    await adjust_reminder_counts(deleted_enabled_user_ids)
+    logging.info(f"Removed {len(extra_ids)} duplicate medication reminders")
+
+async def ensure_unique_reminder_index():
+    """One reminder per medication per user; reminders without a string medication_id are left out of the index"""
+    global reminder_unique_index_ready
+    try:
+        # An earlier build of this index had no partial filter; it must go before the partial one can be created
+        indexes = await db.medication_reminders.index_information()
+        for name, info in indexes.items():
+            if info["key"] == REMINDER_UNIQUE_INDEX_KEYS and "partialFilterExpression" not in info:
+                await db.medication_reminders.drop_index(name)
+        
+        await dedupe_medication_reminders()
+        await db.medication_reminders.create_index(
+            REMINDER_UNIQUE_INDEX_KEYS,
+            unique=True,
+            partialFilterExpression={"medication_id": {"$type": "string"}}
+        )
+        reminder_unique_index_ready = True
+    except Exception as e:
+        logging.error(f"Error creating unique reminder index: {e}")
+
+
 # Define Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -197,13 +441,14 @@ class User(BaseModel):
     daily_routine: Optional[dict] = None
     sfda_searches_used: int = 0  # Track SFDA searches for free users (max 3)
     medications_added_count: int = 0  # Track total medications added (never decreases)
+    active_reminder_count: int = 0  # Current number of enabled reminders (kept in step on create/delete/toggle)
     subscription_tier: str = "trial"  # trial, weekly, monthly, yearly
     subscription_start_date: Optional[str] = None
     subscription_end_date: Optional[str] = None
     trial_used: bool = False  # Track if user has used their 48h trial
     account_deleted: bool = False  # Track if account was deleted (for phone reuse prevention)
     last_login: Optional[str] = None  # Track last login time
-    created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # Stored as a BSON date
 
 class UserRegister(BaseModel):
     password: str
@@ -483,6 +728,22 @@ MEDICATION_TIMING_RULES = {
     }
 }
 
+# Default reminder times by number of doses per day (used when the user confirms a dosage without times)
+REMINDER_TIMES_BY_FREQUENCY = {
+    1: ('09:00',),
+    2: ('09:00', '21:00'),
+    3: ('08:00', '14:00', '20:00'),
+    4: ('08:00', '12:00', '17:00', '21:00')
+}
+
+@lru_cache(maxsize=32)
+def get_reminder_times_for_frequency(times_per_day: int) -> tuple:
+    """Return reminder times for N doses per day, distributing evenly from 08:00 for unusual frequencies"""
+    if times_per_day in REMINDER_TIMES_BY_FREQUENCY:
+        return REMINDER_TIMES_BY_FREQUENCY[times_per_day]
+    interval = 24 // times_per_day
+    return tuple(f"{(8 + i * interval) % 24:02d}:00" for i in range(times_per_day))
+
 def get_suggested_times(classification: str, frequency: str = None, language: str = "en") -> tuple:
     """
     Get suggested medication times based on classification and frequency.
@@ -565,15 +826,34 @@ def create_jwt_token(user_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# Decoded payloads of recently verified tokens, so polling clients skip the signature check
+jwt_payload_cache = TTLCache(maxsize=10000, ttl=60)
+
 def verify_jwt_token(token: str) -> dict:
+    payload = jwt_payload_cache.get(token)
+    if payload is not None:
+        # A cached payload must still honour the token's own expiry
+        if payload.get("exp", 0) > datetime.now(timezone.utc).timestamp():
+            return dict(payload)
+        jwt_payload_cache.pop(token, None)
+        raise HTTPException(status_code=401, detail="Token expired")
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
+        jwt_payload_cache[token] = payload
+        return dict(payload)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Short-lived cache of authenticated user documents, keyed by user id
+# (writes to a user document call invalidate_cached_user)
+current_user_cache = TTLCache(maxsize=10000, ttl=30)
+
+def invalidate_cached_user(user_id: str):
+    """Drop a user from the current-user cache after their document changes"""
+    current_user_cache.pop(user_id, None)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Dependency to get current user from JWT token"""
     token = credentials.credentials
@@ -583,12 +863,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if user_id is None:
         raise HTTPException(status_code=401, detail="Invalid token")
     
-    # Fetch user from database
-    user = await db.users.find_one({"id": user_id}, {"password_hash": 0, "_id": 0})
+    user = current_user_cache.get(user_id)
     if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
+        # Fetch user from database
+        user = await db.users.find_one({"id": user_id}, {"password_hash": 0, "_id": 0})
+        if user is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        current_user_cache[user_id] = user
     
-    return user
+    # Handlers may modify the dict, so never hand out the cached instance
+    return dict(user)
 
 async def create_notification(user_id: str, title: str, body: str, notification_type: str = "info", data: dict = None):
     """Helper function to create a notification"""
@@ -615,6 +899,24 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
     return current_user
 
 
+def parse_ai_json(text: str) -> Optional[dict]:
+    """Parse a JSON object from an AI response.
+    
+    Tries the whole text first (the common case when the model follows instructions),
+    then falls back to the outermost {...} for responses wrapped in prose or markdown.
+    Returns None if no JSON object is found; raises ValueError if it is malformed.
+    """
+    try:
+        parsed = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        json_start = text.find('{')
+        json_end = text.rfind('}') + 1
+        if json_start < 0 or json_end <= json_start:
+            return None
+        parsed = orjson.loads(text[json_start:json_end])
+    return parsed if isinstance(parsed, dict) else None
+
+
 def validate_saudi_phone(phone: str) -> str:
     """Validate and normalize Saudi phone number (05xxxxxxxx format only)"""
     # Remove spaces and special characters except digits
@@ -686,28 +988,29 @@ async def login(credentials: UserLogin):
     # Validate and normalize phone
     phone = validate_saudi_phone(credentials.phone)
     
-    user = await db.users.find_one({"phone": phone})
+    # password fields are needed for verification below, so only _id can be projected out here
+    user = await db.users.find_one({"phone": phone}, {"_id": 0})
     # Support both 'password' and 'password_hash' field names
     password_field = user.get("password_hash") or user.get("password") if user else None
     if not user or not password_field or not verify_password(credentials.password, password_field):
         raise HTTPException(status_code=401, detail="رقم الجوال أو كلمة المرور غير صحيحة / Invalid phone or password")
     
     # Update last login time
+    now_iso = datetime.now(timezone.utc).isoformat()
     await db.users.update_one(
         {"phone": phone},
-        {"$set": {"last_login": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"last_login": now_iso}}
     )
     
     token = create_jwt_token(user["id"], user["phone"])
-    user["last_login"] = datetime.now(timezone.utc).isoformat()
+    user["last_login"] = now_iso
     user.pop("password_hash", None)
     user.pop("password", None)  # Remove password field if exists
-    user.pop("_id", None)
     return {"token": token, "user": user}
 
 
 # Medication Routes
-@api_router.get("/medications", response_model=List[Medication])
+@api_router.get("/medications")
 async def get_medications(search: Optional[str] = None):
     query = {}
     if search:
@@ -718,8 +1021,10 @@ async def get_medications(search: Optional[str] = None):
                 {"scientific_name": {"$regex": search, "$options": "i"}}
             ]
         }
-    medications = await db.medications.find(query, {"_id": 0}).to_list(100)
-    return medications
+    # limit() lets the server return the page in one batch and close the cursor itself
+    medications = await db.medications.find(query, {"_id": 0}).limit(100).to_list(100)
+    # Read-only list: Mongo already returns the stored schema, skip Pydantic validation
+    return ORJSONResponse(medications)
 
 # Search SFDA Medications Route
 @api_router.get("/medications/{medication_id}", response_model=Medication)
@@ -792,7 +1097,7 @@ Find:
 - Package size/count (e.g. 20, 30, 100 - the NUMBER of tablets/capsules in the box)
 - Drug classification (e.g. Antibiotic, NSAID, Diuretic, Statin, Thyroid, Corticosteroid, Antihypertensive, PPI, etc.)
 
-Return JSON only:
+Return JSON:
 {
   "medication_name": "name",
   "active_ingredient": "ingredient",
@@ -807,35 +1112,37 @@ If you can read the medication name, return it. Package size should be a number.
         
         # Call OpenAI Vision API
         try:
-            response = await asyncio.wait_for(
-                client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a pharmaceutical expert. Extract medication information from images accurately."
-                        },
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": prompt
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{image_base64}"
+            async with openai_semaphore:
+                response = await asyncio.wait_for(
+                    client.chat.completions.create(
+                        model="gpt-4o",
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": "You are a pharmaceutical expert. Extract medication information from images accurately."
+                            },
+                            {
+                                "role": "user",
+                                "content": [
+                                    {
+                                        "type": "text",
+                                        "text": prompt
+                                    },
+                                    {
+                                        "type": "image_url",
+                                        "image_url": {
+                                            "url": f"data:image/jpeg;base64,{image_base64}"
+                                        }
                                     }
-                                }
-                            ]
-                        }
-                    ],
-                    max_tokens=500,
-                    temperature=0.3
-                ),
-                timeout=30.0
-            )
+                                ]
+                            }
+                        ],
+                        max_tokens=500,
+                        temperature=0.3,
+                        response_format={"type": "json_object"}
+                    ),
+                    timeout=30.0
+                )
             
             ai_response = response.choices[0].message.content
             
@@ -849,11 +1156,9 @@ If you can read the medication name, return it. Package size should be a number.
         # Parse JSON from response
         result = {}
         try:
-            json_start = ai_response.find('{')
-            json_end = ai_response.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = ai_response[json_start:json_end]
-                result = json.loads(json_str)
+            parsed = parse_ai_json(ai_response)
+            if parsed is not None:
+                result = parsed
                 logging.info(f"Successfully parsed: {result}")
             else:
                 logging.error(f"No JSON found in response: {ai_response[:200]}")
@@ -900,6 +1205,15 @@ If you can read the medication name, return it. Package size should be a number.
 
 
 # User Medications Routes
+# Medication lists are unbounded unless the client opts into paging with limit (older clients send no params)
+USER_MEDICATIONS_MAX_PAGE_SIZE = 500
+USER_MEDICATIONS_BATCH_SIZE = 50
+
+def next_page_link(request: Request, skip: int, limit: int) -> dict:
+    """Link header pointing at the next skip/limit page, so paging clients know the list continues"""
+    next_url = request.url.include_query_params(skip=skip + limit, limit=limit)
+    return {"Link": f'<{next_url}>; rel="next"'}
+
 @api_router.post("/user-medications")
 async def add_user_medication(
     medication_data: UserMedicationCreate,
@@ -908,8 +1222,8 @@ async def add_user_medication(
     user_id = current_user["id"]
     is_premium = current_user.get("is_premium", False)
     
-    # Check medication limit for free users
-    can_add = await check_medication_limit(user_id, is_premium)
+    # Check medication limit for free users (atomically claims a slot by incrementing the counter)
+    can_add = await reserve_medication_slot(user_id, is_premium)
     if not can_add:
         raise HTTPException(
             status_code=403,
@@ -930,9 +1244,15 @@ async def add_user_medication(
     user_med = UserMedication(**med_dict)
     
     doc = user_med.model_dump()
-    await db.user_medications.insert_one(doc)
+    try:
+        await db.user_medications.insert_one(doc)
+    except Exception:
+        # Give the reserved slot back if the medication could not be saved
+        await release_medication_slot(user_id, is_premium)
+        raise
     
     # Auto-create reminders if user_dosage_confirmed is True
+    new_reminder = None
     if med_dict.get('user_dosage_confirmed') is True and med_dict.get('times'):
         reminder_times = med_dict['times']
         medication_id = doc['id']
@@ -947,44 +1267,84 @@ async def add_user_medication(
             "reminder_times": reminder_times,
             "enabled": True,
             "adherence_log": [],
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": doc["created_at"]  # Same timestamp as the medication itself
         }
-        await db.medication_reminders.insert_one(new_reminder)
-        logger.info(f"✅ Created reminders for new medication {medication_id}: {reminder_times}")
-    
-    # Increment medications_added_count for free users (permanent counter)
-    if not is_premium:
-        await db.users.update_one(
-            {"id": user_id},
-            {"$inc": {"medications_added_count": 1}}
-        )
+        # Only after the medication exists, so a failure here never orphans a reminder
+        try:
+            await db.medication_reminders.insert_one(new_reminder)
+        except Exception as e:
+            # The medication is saved and keeps its slot; the user can add the reminder again
+            logger.error(f"Failed to create reminder for new medication {medication_id}: {e}")
+        else:
+            await adjust_reminder_count(user_id, 1)
+            logger.info(f"✅ Created reminders for new medication {medication_id}: {reminder_times}")
     
     return user_med
 
 # Add Medication from Search Route
-@api_router.get("/user-medications", response_model=List[UserMedication])
-async def get_user_medications(current_user: dict = Depends(get_current_user)):
+@api_router.get("/user-medications")
+async def get_user_medications(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=USER_MEDICATIONS_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
     user_id = current_user["id"]
     
-    medications = await db.user_medications.find(
-        {"user_id": user_id, "active": True},
-        {"_id": 0}
-    ).to_list(None)  # No limit - support infinite medications
-    
-    # Enrich medications with price from SFDA database
+    # Join SFDA prices server-side: exact match on the lowercased brand name (indexed trade_name_lower)
+    pipeline = [
+        {"$match": {"user_id": user_id, "active": True}},
+        # Deterministic order so skip/limit pages never repeat or drop medications
+        {"$sort": {"created_at": 1, "id": 1}},
+        {"$skip": skip},
+        # One extra document tells whether another page follows
+        *([{"$limit": limit + 1}] if limit else []),
+        {"$addFields": {
+            "_brand_lower": {"$toLower": {"$trim": {"input": {"$ifNull": ["$brand_name", ""]}}}}
+        }},
+        {"$lookup": {
+            "from": "sfda_medications",
+            "localField": "_brand_lower",
+            "foreignField": "trade_name_lower",
+            "pipeline": [
+                {"$match": {"price_sar": {"$nin": [None, 0]}}},
+                {"$project": {"_id": 0, "price_sar": 1}},
+                {"$limit": 1}
+            ],
+            "as": "_sfda"
+        }},
+        {"$addFields": {"_sfda_price": {"$arrayElemAt": ["$_sfda.price_sar", 0]}}},
+        {"$project": {"_id": 0, "_sfda": 0}}
+    ]
+    medications = await db.user_medications.aggregate(pipeline, batchSize=USER_MEDICATIONS_BATCH_SIZE).to_list(length=None)
+    headers = None
+    if limit and len(medications) > limit:
+        medications = medications[:limit]
+        headers = next_page_link(request, skip, limit)
+    
+    # Brands without an exact SFDA match fall back to a prefix match (e.g. "Panadol" -> "panadol extra")
+    unmatched = []
     for med in medications:
-        brand_name = med.get('brand_name', '').strip()
-        if brand_name:
-            # Try to find price in SFDA database by brand name (using regex for partial match)
-            regex_pattern = f"^{re.escape(brand_name)}"
-            sfda_med = await db.sfda_medications.find_one(
-                {"trade_name_lower": {"$regex": regex_pattern, "$options": "i"}},
+        brand_lower = med.pop("_brand_lower", "")
+        sfda_price = med.pop("_sfda_price", None)
+        if sfda_price:
+            med['price_sar'] = sfda_price
+        elif brand_lower:
+            unmatched.append((med, brand_lower))
+    
+    if unmatched:
+        fallback_matches = await asyncio.gather(*[
+            db.sfda_medications.find_one(
+                {"trade_name_lower": {"$regex": f"^{re.escape(brand_lower)}"}},
                 {"_id": 0, "price_sar": 1}
             )
+            for _, brand_lower in unmatched
+        ])
+        for (med, _), sfda_med in zip(unmatched, fallback_matches):
             if sfda_med and sfda_med.get('price_sar'):
                 med['price_sar'] = sfda_med['price_sar']
     
-    return medications
+    return ORJSONResponse(medications, headers=headers)
 
 @api_router.delete("/user-medications/{medication_id}")
 async def delete_user_medication(medication_id: str, current_user: dict = Depends(get_current_user)):
@@ -1000,10 +1360,12 @@ async def delete_user_medication(medication_id: str, current_user: dict = Depend
     })
     
     # Delete all reminders associated with this medication
-    reminders_result = await db.medication_reminders.delete_many({
-        "user_id": user_id,
-        "medication_id": medication_id
-    })
+    reminders = await db.medication_reminders.find(
+        {"user_id": user_id, "medication_id": medication_id},
+        {"_id": 1, "enabled": 1}
+    ).to_list(length=None)
+    reminders_result = await db.medication_reminders.delete_many({"_id": {"$in": [r["_id"] for r in reminders]}})
+    await adjust_reminder_count(user_id, -sum(1 for r in reminders if is_reminder_enabled(r)))
     
     return {
         "message": "Medication and associated reminders deleted",
@@ -1027,9 +1389,6 @@ async def unarchive_user_medication(medication_id: str, current_user: dict = Dep
     )
     return {"message": "Medication restored"}
 
-@api_router.get("/user-medications/archived", response_model=List[UserMedication])
-
-
 @api_router.put("/user-medications/{medication_id}")
 async def update_medication(
     medication_id: str,
@@ -1073,20 +1432,7 @@ async def update_medication(
                 times_per_day = int(user_dosage_info.get('times_per_day', 1))
                 
                 # Calculate reminder times based on times_per_day
-                if times_per_day == 1:
-                    reminder_times = ['09:00']
-                elif times_per_day == 2:
-                    reminder_times = ['09:00', '21:00']
-                elif times_per_day == 3:
-                    reminder_times = ['08:00', '14:00', '20:00']
-                elif times_per_day == 4:
-                    reminder_times = ['08:00', '12:00', '17:00', '21:00']
-                else:
-                    # For more than 4 times, distribute evenly
-                    interval = 24 // times_per_day
-                    for i in range(times_per_day):
-                        hour = (8 + (i * interval)) % 24
-                        reminder_times.append(f"{hour:02d}:00")
+                reminder_times = list(get_reminder_times_for_frequency(times_per_day))
             
             # Only create/update reminder if we have valid times
             if reminder_times and len(reminder_times) > 0:
@@ -1098,18 +1444,7 @@ async def update_medication(
                 
                 medication_name = medication.get('brand_name') or medication.get('trade_name') or medication.get('condition') or 'Medication'
                 
-                if existing_reminder:
-                    # Update existing reminder
-                    await db.medication_reminders.update_one(
-                        {"medication_id": medication_id, "user_id": current_user["id"]},
-                        {"$set": {
-                            "reminder_times": reminder_times,
-                            "enabled": True,
-                            "medication_name": medication_name
-                        }}
-                    )
-                    logger.info(f"Updated reminders for medication {medication_id}: {reminder_times}")
-                else:
+                if not existing_reminder:
                     # Create new reminder
                     new_reminder = {
                         "id": str(uuid.uuid4()),
@@ -1121,8 +1456,30 @@ async def update_medication(
                         "adherence_log": [],
                         "created_at": datetime.now(timezone.utc).isoformat()
                     }
-                    await db.medication_reminders.insert_one(new_reminder)
-                    logger.info(f"Created reminders for medication {medication_id}: {reminder_times}")
+                    try:
+                        await db.medication_reminders.insert_one(new_reminder)
+                        await adjust_reminder_count(current_user["id"], 1)
+                        logger.info(f"Created reminders for medication {medication_id}: {reminder_times}")
+                    except DuplicateKeyError:
+                        # A concurrent request created it first; update that reminder instead
+                        existing_reminder = await db.medication_reminders.find_one(
+                            {"medication_id": medication_id, "user_id": current_user["id"]},
+                            {"_id": 0}
+                        )
+                
+                if existing_reminder:
+                    # Update existing reminder
+                    await db.medication_reminders.update_one(
+                        {"medication_id": medication_id, "user_id": current_user["id"]},
+                        {"$set": {
+                            "reminder_times": reminder_times,
+                            "enabled": True,
+                            "medication_name": medication_name
+                        }}
+                    )
+                    if not is_reminder_enabled(existing_reminder):
+                        await adjust_reminder_count(current_user["id"], 1)
+                    logger.info(f"Updated reminders for medication {medication_id}: {reminder_times}")
         
         return {"success": True, "message": "Medication updated successfully"}
     
@@ -1131,15 +1488,26 @@ async def update_medication(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating medication: {str(e)}")
 
-async def get_archived_medications(current_user: dict = Depends(get_current_user)):
+@api_router.get("/user-medications/archived")
+async def get_archived_medications(
+    request: Request,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=USER_MEDICATIONS_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
     user_id = current_user["id"]
     
+    # One extra document tells whether another page follows
     medications = await db.user_medications.find(
         {"user_id": user_id, "archived": True},
         {"_id": 0}
-    ).to_list(None)  # No limit - support infinite archived medications
+    ).sort([("created_at", 1), ("id", 1)]).skip(skip).limit(limit + 1 if limit else 0).batch_size(USER_MEDICATIONS_BATCH_SIZE).to_list(length=None)
+    headers = None
+    if limit and len(medications) > limit:
+        medications = medications[:limit]
+        headers = next_page_link(request, skip, limit)
     
-    return medications
+    return ORJSONResponse(medications, headers=headers)
 
 
 
@@ -1158,6 +1526,7 @@ async def accept_terms(current_user: dict = Depends(get_current_user)):
                 "terms_accepted_at": datetime.now(timezone.utc).isoformat()
             }}
         )
+        invalidate_cached_user(user_id)
         
         logger.info(f"User {user_id} accepted terms and conditions")
         
@@ -1168,25 +1537,94 @@ async def accept_terms(current_user: dict = Depends(get_current_user)):
 
 
 # Drug Interaction Checker
+def interaction_pair_key(medication_id_a: str, medication_id_b: str) -> str:
+    """Order-independent key for a pair of catalog medications"""
+    return "|".join(sorted((medication_id_a, medication_id_b)))
+
+async def build_interaction_pairs():
+    """Precompute interacting medication pairs from the catalog so lookups don't recompute them per request
+    
+    Each build stamps its pairs with a fresh build_id and then drops every pair from earlier builds,
+    so pairs for catalog entries that were removed or re-keyed (e.g. by import_sfda_excel.py) go away.
+    """
+    try:
+        medications = await db.medications.find(
+            {},
+            {"_id": 0, "id": 1, "commercial_name_en": 1, "scientific_name": 1, "interactions": 1}
+        ).to_list(None)
+        
+        # Index catalog entries by the names an interaction list can refer to
+        meds_by_name = {}
+        for med in medications:
+            for name in (med.get("scientific_name"), med.get("commercial_name_en")):
+                if name:
+                    meds_by_name.setdefault(name, []).append(med)
+        
+        build_id = str(uuid.uuid4())
+        operations = []
+        seen_keys = set()
+        for med1 in medications:
+            interactions = med1.get("interactions")
+            if not med1.get("id") or not isinstance(interactions, list):
+                continue
+            for interacting_name in interactions:
+                if not isinstance(interacting_name, str):
+                    continue
+                for med2 in meds_by_name.get(interacting_name, []):
+                    if not med2.get("id") or med2["id"] == med1["id"]:
+                        continue
+                    pair_key = interaction_pair_key(med1["id"], med2["id"])
+                    if pair_key in seen_keys:
+                        continue
+                    seen_keys.add(pair_key)
+                    operations.append(UpdateOne(
+                        {"pair_key": pair_key},
+                        {"$set": {
+                            "pair_key": pair_key,
+                            "build_id": build_id,
+                            "medication1": med1.get("commercial_name_en"),
+                            "medication2": med2.get("commercial_name_en"),
+                            "severity": "moderate",
+                            "description": f"Potential interaction between {med1.get('scientific_name')} and {med2.get('scientific_name')}"
+                        }},
+                        upsert=True
+                    ))
+        
+        await db.interaction_pairs.create_index("pair_key", unique=True)
+        if operations:
+            await db.interaction_pairs.bulk_write(operations, ordered=False)
+        # Pairs not rewritten by this build refer to medications that no longer exist
+        stale = await db.interaction_pairs.delete_many({"build_id": {"$ne": build_id}})
+        logging.info(f"Interaction pairs precomputed: {len(operations)} (removed {stale.deleted_count} stale)")
+    except Exception as e:
+        logging.error(f"Error building interaction pairs: {e}")
+
+# The catalog can be rewritten by the import scripts while the app runs, so pairs are rebuilt periodically
+INTERACTION_PAIRS_REFRESH_INTERVAL_SECONDS = 3600
+interaction_pairs_refresher_task = None
+
+async def interaction_pairs_refresher():
+    """Periodically rebuild interaction pairs so catalog imports are picked up without a restart"""
+    while True:
+        await asyncio.sleep(INTERACTION_PAIRS_REFRESH_INTERVAL_SECONDS)
+        await build_interaction_pairs()
+
 @api_router.post("/check-interactions")
 async def check_interactions(medication_ids: List[str]):
-    medications = await db.medications.find(
-        {"id": {"$in": medication_ids}},
-        {"_id": 0}
-    ).to_list(100)
-    
-    interactions = []
-    for i, med1 in enumerate(medications):
-        for med2 in medications[i+1:]:
-            # Check if any interactions exist
-            med1_interactions = set(med1.get("interactions", []))
-            if med2["scientific_name"] in med1_interactions or med2["commercial_name_en"] in med1_interactions:
-                interactions.append({
-                    "medication1": med1["commercial_name_en"],
-                    "medication2": med2["commercial_name_en"],
-                    "severity": "moderate",
-                    "description": f"Potential interaction between {med1['scientific_name']} and {med2['scientific_name']}"
-                })
+    unique_ids = list(dict.fromkeys(medication_ids))
+    pair_keys = [
+        interaction_pair_key(id1, id2)
+        for i, id1 in enumerate(unique_ids)
+        for id2 in unique_ids[i+1:]
+    ]
+    
+    if not pair_keys:
+        return {"interactions": []}
+    
+    interactions = await db.interaction_pairs.find(
+        {"pair_key": {"$in": pair_keys}},
+        {"_id": 0, "pair_key": 0}
+    ).to_list(None)
     
     return {"interactions": interactions}
 
@@ -1348,7 +1786,7 @@ IMPORTANT:
 - Do NOT check interactions between ingredients within the same medication
 - If ingredients are from same brand, they are in ONE medication
 
-Return ONLY valid JSON (no markdown):
+Return JSON:
 {{
   "has_interactions": true/false,
   "total_interactions": number,
@@ -1366,39 +1804,36 @@ Return ONLY valid JSON (no markdown):
 Check interactions between DIFFERENT medications only. If no interactions found, return empty interactions array."""
         
         # Call OpenAI
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a clinical pharmacist. Check interactions ONLY between different medications, NOT between ingredients within the same medication. Return JSON only."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            max_tokens=1000,
-            temperature=0.3
-        )
+        async with openai_semaphore:
+            response = await client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a clinical pharmacist. Check interactions ONLY between different medications, NOT between ingredients within the same medication. Return JSON only."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                max_tokens=1000,
+                temperature=0.3,
+                response_format={"type": "json_object"}
+            )
         
         response_text = response.choices[0].message.content
         
         # Parse JSON response
-        import json
         try:
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = response[json_start:json_end]
-                interaction_data = json.loads(json_str)
-            else:
+            interaction_data = parse_ai_json(response_text)
+            if interaction_data is None:
                 interaction_data = {
                     "has_interactions": False,
                     "total_interactions": 0,
                     "interactions": []
                 }
-        except (json.JSONDecodeError, ValueError):
+        except ValueError:
             interaction_data = {
                 "has_interactions": False,
                 "total_interactions": 0,
@@ -1434,196 +1869,292 @@ Check interactions between DIFFERENT medications only. If no interactions found,
 
 
 # Get Medication Details Route
-@api_router.post("/medications/get-details")
-async def get_medication_details(request: dict, current_user: dict = Depends(get_current_user)):
-    """Get comprehensive medication information from Drug Guide and SFDA databases"""
-    try:
-        medication_name = request.get("medication_name", "")
-        active_ingredient = request.get("active_ingredient", "")
-        language = request.get("language", "en")
-        
-        logging.info(f"Getting details for: {medication_name} ({active_ingredient})")
-        
-        # Step 1: Try Drug Guide first (comprehensive info)
-        # Search by trade name first (more specific), then by generic
-        drug_guide = None
-        
-        # Try exact match with trade name first
-        if medication_name:
-            # Try to find exact match in variants
-            drug_guide = await db.drug_guide.find_one({
-                "variants": {
-                    "$elemMatch": {
-                        "trade_name": {"$regex": f"^{medication_name}$", "$options": "i"}
-                    }
-                }
-            })
-            
-            # If not found, try broader search (contains)
-            if not drug_guide:
-                drug_guide = await db.drug_guide.find_one({
-                    "variants.trade_name": {"$regex": medication_name, "$options": "i"}
-                })
-        
-        # If not found by trade name, try by generic (active ingredient) - but only exact match
-        if not drug_guide and active_ingredient:
-            # Only match if generic is EXACTLY the same (not just contains)
-            drug_guide = await db.drug_guide.find_one({
-                "generic_lower": active_ingredient.lower().strip()
-            })
-        
-        if drug_guide:
-            logging.info(f"✅ Found in Drug Guide: {drug_guide.get('generic')}")
-            
-            # Find matching variant if exists
-            variants = drug_guide.get('variants', [])
-            matching_variant = None
-            for v in variants:
-                if medication_name.lower() in v.get('trade_name', '').lower():
-                    matching_variant = v
-                    break
-            
-            # Use first variant if no match
-            if not matching_variant and variants:
-                matching_variant = variants[0]
-            
-            trade_name_display = matching_variant.get('trade_name', medication_name) if matching_variant else medication_name
-            company_display = matching_variant.get('company', 'غير متوفر') if matching_variant else 'غير متوفر'
-            
-            # Get SFDA price if available
-            sfda_price = None
-            sfda_med = await db.sfda_medications.find_one({
-                "$or": [
-                    {"trade_name_lower": medication_name.lower()},
-                    {"active_ingredients_lower": {"$regex": active_ingredient.lower()}}
-                ]
-            })
-            if sfda_med:
-                sfda_price = sfda_med.get('price_sar')
-            
-            # Show available variants
-            variants_list = ""
-            if len(variants) > 1:
-                if language == "ar":
-                    variants_list = "\n\n**📦 العبوات المتوفرة:**\n"
-                    for v in variants[:5]:  # Show max 5
-                        variants_list += f"• {v.get('trade_name', '')}\n"
-                else:
-                    variants_list = "\n\n**📦 Available Variants:**\n"
-                    for v in variants[:5]:
-                        variants_list += f"• {v.get('trade_name', '')}\n"
-            
-            # Format details based on language
-            if language == "ar":
-                details = f"""
+def build_sfda_lookup_conditions(medication_name: str, active_ingredient: str) -> List[dict]:
+    """Build index-friendly SFDA lookups in priority order: exact trade name, then anchored active-ingredient prefix"""
+    conditions = []
+    trade_name = (medication_name or "").lower().strip()
+    if trade_name:
+        conditions.append({"trade_name_lower": trade_name})
+    ingredient = (active_ingredient or "").lower().strip()
+    if ingredient:
+        # active_ingredients_lower holds the full ingredient list, so match it as an anchored prefix
+        conditions.append({"active_ingredients_lower": {"$regex": f"^{re.escape(ingredient)}"}})
+    
+    return conditions
+
+# Formatted get_medication_details responses, keyed on (medication_name, active_ingredient, language)
+medication_details_cache = TTLCache(maxsize=4096, ttl=3600)
+
+# Only the fields rendered by get_medication_details
+SFDA_DETAILS_PROJECTION = {
+    "_id": 0, "trade_name": 1, "active_ingredients": 1, "manufacturer": 1,
+    "price_sar": 1, "pack": 1, "strength": 1
+}
+
+# Detail text templates for get_medication_details (missing fields render as "not available")
+DRUG_GUIDE_DETAILS_TEMPLATE_AR = """
 📋 **الاسم التجاري:** {trade_name_display}
-💊 **المادة الفعالة:** {drug_guide.get('generic', 'غير متوفر')}
+💊 **المادة الفعالة:** {generic}
 🏭 **الشركة المصنعة:** {company_display}
-💰 **السعر:** {sfda_price if sfda_price else 'غير متوفر'} ريال
+💰 **السعر:** {price} ريال
 {variants_list}
 **📖 الاستخدامات:**
-{drug_guide.get('usage', 'غير متوفر')}
+{usage}
 
 **💊 كيفية الاستخدام:**
-{drug_guide.get('how_to_use', 'غير متوفر')}
+{how_to_use}
 
 **⚠️ تحذيرات مهمة:**
-{drug_guide.get('warnings', 'غير متوفر')}
+{warnings}
 
 **😷 الآثار الجانبية المحتملة:**
-{drug_guide.get('side_effects', 'غير متوفر')}
+{side_effects}
 
 **🔄 التداخلات الدوائية:**
-{drug_guide.get('interactions', 'غير متوفر')}
+{interactions}
 
 **💡 نصيحة مهمة:**
-{drug_guide.get('key_advice', 'غير متوفر')}
+{key_advice}
 """
-            else:
-                details = f"""
+
+DRUG_GUIDE_VARIANTS_HEADER_AR = "\n\n**📦 العبوات المتوفرة:**\n"
+DRUG_GUIDE_VARIANTS_HEADER_EN = "\n\n**📦 Available Variants:**\n"
+
+DRUG_GUIDE_DETAILS_TEMPLATE_EN = """
 📋 **Trade Name:** {trade_name_display}
-💊 **Active Ingredient:** {drug_guide.get('generic', 'Not available')}
+💊 **Active Ingredient:** {generic}
 🏭 **Manufacturer:** {company_display}
-💰 **Price:** {sfda_price if sfda_price else 'Not available'} SAR
+💰 **Price:** {price} SAR
 {variants_list}
 **📖 What is it used for:**
-{drug_guide.get('usage', 'Not available')}
+{usage}
 
 **💊 How to use:**
-{drug_guide.get('how_to_use', 'Not available')}
+{how_to_use}
 
 **⚠️ Important Warnings:**
-{drug_guide.get('warnings', 'Not available')}
+{warnings}
 
 **😷 Possible Side Effects:**
-{drug_guide.get('side_effects', 'Not available')}
+{side_effects}
 
 **🔄 Drug Interactions:**
-{drug_guide.get('interactions', 'Not available')}
+{interactions}
 
 **💡 Key Advice:**
-{drug_guide.get('key_advice', 'Not available')}
+{key_advice}
 """
-            
-            return {
-                "medication_name": medication_name,
-                "active_ingredient": active_ingredient,
-                "details": details,
-                "source": "Drug Guide",
-                "reliability": 0.95,
-                "available": True
-            }
-        
-        # Step 2: Fallback to SFDA if not in Drug Guide
-        sfda_medication = await db.sfda_medications.find_one({
-            "$or": [
-                {"trade_name_lower": medication_name.lower()},
-                {"active_ingredients_lower": {"$regex": active_ingredient.lower()}}
-            ]
-        })
-        
-        if sfda_medication:
-            logging.info(f"✅ Found in SFDA: {sfda_medication.get('trade_name')}")
-            
-            details_ar = f"""
-📋 الاسم التجاري: {sfda_medication.get('trade_name', 'غير متوفر')}
-💊 المادة الفعالة: {sfda_medication.get('active_ingredients', 'غير متوفر')}
-🏭 الشركة المصنعة: {sfda_medication.get('manufacturer', 'غير متوفر')}
-💰 السعر: {sfda_medication.get('price_sar', 'غير متوفر')} ريال
-📦 العبوة: {sfda_medication.get('pack', 'غير متوفر')}
-⚕️ القوة: {sfda_medication.get('strength', 'غير متوفر')}
+
+SFDA_DETAILS_TEMPLATE_AR = """
+📋 الاسم التجاري: {trade_name}
+💊 المادة الفعالة: {active_ingredients}
+🏭 الشركة المصنعة: {manufacturer}
+💰 السعر: {price_sar} ريال
+📦 العبوة: {pack}
+⚕️ القوة: {strength}
 """
-            
-            details_en = f"""
-📋 Trade Name: {sfda_medication.get('trade_name', 'Not available')}
-💊 Active Ingredient: {sfda_medication.get('active_ingredients', 'Not available')}
-🏭 Manufacturer: {sfda_medication.get('manufacturer', 'Not available')}
-💰 Price: {sfda_medication.get('price_sar', 'Not available')} SAR
-📦 Pack: {sfda_medication.get('pack', 'Not available')}
-⚕️ Strength: {sfda_medication.get('strength', 'Not available')}
+
+SFDA_DETAILS_TEMPLATE_EN = """
+📋 Trade Name: {trade_name}
+💊 Active Ingredient: {active_ingredients}
+🏭 Manufacturer: {manufacturer}
+💰 Price: {price_sar} SAR
+📦 Pack: {pack}
+⚕️ Strength: {strength}
 """
-            
-            return {
-                "medication_name": medication_name,
-                "active_ingredient": active_ingredient,
-                "details": details_ar if language == "ar" else details_en,
-                "source": "SFDA",
-                "reliability": 1.0,
-                "available": True
+
+def drug_guide_details_pipeline(match: dict, medication_name: str) -> list:
+    """Aggregation returning one Drug Guide entry with the matching variant selected server-side.
+    
+    Instead of the full variants array, the result carries matching_variant (first variant whose
+    trade name contains medication_name, else the first variant), variant_count and
+    variant_names (first 5 trade names, for display).
+    """
+    variants = {"$ifNull": ["$variants", []]}
+    return [
+        {"$match": match},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 0,
+            "generic": 1, "usage": 1, "how_to_use": 1, "warnings": 1,
+            "side_effects": 1, "interactions": 1, "key_advice": 1,
+            "matching_variant": {"$ifNull": [
+                {"$arrayElemAt": [
+                    {"$filter": {
+                        "input": variants,
+                        "cond": {"$regexMatch": {
+                            "input": {"$toLower": {"$ifNull": ["$$this.trade_name", ""]}},
+                            "regex": re.escape((medication_name or "").lower())
+                        }}
+                    }},
+                    0
+                ]},
+                {"$arrayElemAt": [variants, 0]}
+            ]},
+            "variant_count": {"$size": variants},
+            "variant_names": {"$map": {
+                "input": {"$slice": [variants, 5]},
+                "in": {"$ifNull": ["$$this.trade_name", ""]}
+            }}
+        }}
+    ]
+
+async def find_drug_guide_entry(medication_name: str, active_ingredient: str) -> Optional[dict]:
+    """Find a Drug Guide entry by trade name first (more specific), then by generic"""
+    async def find_one(match: dict) -> Optional[dict]:
+        results = await db.drug_guide.aggregate(drug_guide_details_pipeline(match, medication_name)).to_list(length=1)
+        return results[0] if results else None
+    
+    async def no_match() -> None:
+        return None
+    
+    # The exact trade-name and generic lookups are indexed and independent, so they run concurrently
+    safe_name = re.escape(medication_name.strip()) if medication_name else None
+    exact_lookup = find_one({
+        "variants": {
+            "$elemMatch": {
+                "trade_name": {"$regex": f"^{safe_name}$", "$options": "i"}
             }
+        }
+    }) if safe_name else no_match()
+    # Only match if generic is EXACTLY the same (not just contains)
+    generic_lookup = find_one({
+        "generic_lower": normalize_generic_name(active_ingredient)
+    }) if active_ingredient else no_match()
+    
+    exact_match, generic_match = await asyncio.gather(exact_lookup, generic_lookup)
+    if exact_match:
+        return exact_match
+    
+    # Broader search (contains) can't use an index, so it only runs when the exact trade name misses
+    if safe_name:
+        contains_match = await find_one({
+            "variants.trade_name": {"$regex": safe_name, "$options": "i"}
+        })
+        if contains_match:
+            return contains_match
+    
+    return generic_match
+
+async def find_sfda_medication(medication_name: str, active_ingredient: str) -> Optional[dict]:
+    """Find the SFDA record matching a medication's trade name or active ingredient"""
+    conditions = build_sfda_lookup_conditions(medication_name, active_ingredient)
+    if not conditions:
+        return None
+    
+    # One query per condition instead of an $or, so each is served by its own single-field index
+    results = await asyncio.gather(*[
+        db.sfda_medications.find_one(condition, SFDA_DETAILS_PROJECTION)
+        for condition in conditions
+    ])
+    return next((result for result in results if result), None)
+
+async def build_medication_details(medication_name: str, active_ingredient: str, language: str) -> dict:
+    """Look up a medication in Drug Guide / SFDA and format its details for display"""
+    # Drug Guide (comprehensive info) and SFDA (price / fallback) lookups are independent,
+    # so fetch both in one concurrent round instead of two sequential ones
+    drug_guide, sfda_medication = await asyncio.gather(
+        find_drug_guide_entry(medication_name, active_ingredient),
+        find_sfda_medication(medication_name, active_ingredient)
+    )
+    
+    if drug_guide:
+        logging.info(f"✅ Found in Drug Guide: {drug_guide.get('generic')}")
+        
+        # Matching variant (or the first one) is selected by the aggregation
+        matching_variant = drug_guide.get('matching_variant')
+        
+        trade_name_display = matching_variant.get('trade_name', medication_name) if matching_variant else medication_name
+        company_display = matching_variant.get('company', 'غير متوفر') if matching_variant else 'غير متوفر'
+        
+        # Get SFDA price if available
+        sfda_price = sfda_medication.get('price_sar') if sfda_medication else None
+        
+        # Show available variants
+        variants_list = ""
+        if drug_guide.get('variant_count', 0) > 1:
+            # variant_names is pre-sliced to 5 names by the aggregation ($slice)
+            variants_list = DRUG_GUIDE_VARIANTS_HEADER_AR if language == "ar" else DRUG_GUIDE_VARIANTS_HEADER_EN
+            variants_list += "\n".join(f"• {name}" for name in drug_guide.get('variant_names', [])) + "\n"
+        
+        # Format details based on language
+        not_available = 'غير متوفر' if language == "ar" else 'Not available'
+        template = DRUG_GUIDE_DETAILS_TEMPLATE_AR if language == "ar" else DRUG_GUIDE_DETAILS_TEMPLATE_EN
+        fields = defaultdict(lambda: not_available, drug_guide)
+        fields.update(
+            trade_name_display=trade_name_display,
+            company_display=company_display,
+            price=sfda_price if sfda_price else not_available,
+            variants_list=variants_list
+        )
+        details = template.format_map(fields)
         
-        else:
-            # Not found anywhere
-            no_data_msg = "عذراً، لا توجد معلومات متاحة عن هذا الدواء في قاعدة البيانات." if language == "ar" else "Sorry, no information available for this medication in the database."
-            
-            return {
-                "medication_name": medication_name,
-                "active_ingredient": active_ingredient,
-                "details": no_data_msg,
-                "source": "None",
-                "reliability": 0.0,
-                "available": False
-            }
+        return {
+            "medication_name": medication_name,
+            "active_ingredient": active_ingredient,
+            "details": details,
+            "source": "Drug Guide",
+            "reliability": 0.95,
+            "available": True
+        }
+    
+    # Step 2: Fallback to SFDA if not in Drug Guide
+    if sfda_medication:
+        logging.info(f"✅ Found in SFDA: {sfda_medication.get('trade_name')}")
+        
+        not_available = 'غير متوفر' if language == "ar" else 'Not available'
+        template = SFDA_DETAILS_TEMPLATE_AR if language == "ar" else SFDA_DETAILS_TEMPLATE_EN
+        details = template.format_map(defaultdict(lambda: not_available, sfda_medication))
+        
+        return {
+            "medication_name": medication_name,
+            "active_ingredient": active_ingredient,
+            "details": details,
+            "source": "SFDA",
+            "reliability": 1.0,
+            "available": True
+        }
+    
+    else:
+        # Not found anywhere
+        no_data_msg = "عذراً، لا توجد معلومات متاحة عن هذا الدواء في قاعدة البيانات." if language == "ar" else "Sorry, no information available for this medication in the database."
+        
+        return {
+            "medication_name": medication_name,
+            "active_ingredient": active_ingredient,
+            "details": no_data_msg,
+            "source": "None",
+            "reliability": 0.0,
+            "available": False
+        }
+
+
+@api_router.post("/medications/get-details")
+async def get_medication_details(request: dict, current_user: dict = Depends(get_current_user)):
+    """Get comprehensive medication information from Drug Guide and SFDA databases"""
+    try:
+        medication_name = request.get("medication_name", "")
+        active_ingredient = request.get("active_ingredient", "")
+        language = request.get("language", "en")
+        
+        logging.info(f"Getting details for: {medication_name} ({active_ingredient})")
+        
+        # Drug catalogs change rarely - serve repeat lookups from memory. The cached payload is built
+        # from the normalized key values (lookups are case-insensitive), so it never carries one
+        # caller's casing or spacing; the request's own names are added to the response below
+        normalized_name = (medication_name or "").lower().strip()
+        normalized_ingredient = (active_ingredient or "").lower().strip()
+        cache_key = (normalized_name, normalized_ingredient, language)
+        result = medication_details_cache.get(cache_key)
+        if result is None:
+            result = await build_medication_details(normalized_name, normalized_ingredient, language)
+            medication_details_cache[cache_key] = result
+        
+        return {
+            **result,
+            "medication_name": medication_name,
+            "active_ingredient": active_ingredient
+        }
         
     except Exception as e:
         logging.error(f"❌ Medication details error: {str(e)}")
@@ -1651,6 +2182,7 @@ async def update_profile(
         {"id": current_user["id"]},
         {"$set": updates}
     )
+    invalidate_cached_user(current_user["id"])
     
     return {"message": "Profile updated"}
 
@@ -1667,15 +2199,21 @@ async def change_password(
     
     # Verify current password (current_user already has password_hash excluded)
     # We need to get the user with password_hash to verify
-    user_with_password = await db.users.find_one({"id": current_user["id"]})
+    user_with_password = await db.users.find_one(
+        {"id": current_user["id"]},
+        {"password_hash": 1, "password": 1, "_id": 0}
+    )
     if not user_with_password:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if not verify_password(current_password, user_with_password["password_hash"]):
+    # Support both 'password' and 'password_hash' field names (same as login)
+    password_field = user_with_password.get("password_hash") or user_with_password.get("password")
+    # bcrypt is CPU-bound; run it in a worker thread so it doesn't block the event loop
+    if not password_field or not await asyncio.to_thread(verify_password, current_password, password_field):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
     
     # Hash new password and update
-    new_hash = hash_password(new_password)
+    new_hash = await asyncio.to_thread(hash_password, new_password)
     await db.users.update_one(
         {"id": current_user["id"]},
         {"$set": {"password_hash": new_hash}}
@@ -1688,6 +2226,85 @@ async def change_password(
 # Medication Reminders Routes
 # ===========================
 
+def adherence_day(dt: datetime) -> datetime:
+    """Calendar day of dt as a midnight datetime, stored as a BSON Date in adherence_log"""
+    return datetime(dt.year, dt.month, dt.day)
+
+REMINDER_LIST_ADHERENCE_LOG_LIMIT = 50
+# A user's reminders normally fit in one batch, so the first reply carries everything (no getMore)
+REMINDERS_BATCH_SIZE = 200
+
+# A reminder's medication_id refers to either user_medications.id or user_medications.medication_id
+REMINDER_MEDICATION_MATCH_EXPR = {"$or": [
+    {"$eq": ["$id", "$$medication_id"]},
+    {"$eq": ["$medication_id", "$$medication_id"]}
+]}
+
+def find_user_reminders(user_id: str, enabled_only: bool = False, stages: Optional[List[dict]] = None):
+    """Cursor over a user's reminders whose medication still exists, with `stages` appended
+    
+    Each reminder is joined to its active medication in the same aggregation (no query per
+    reminder). A reminder's medication_id may hold either the medication's id or its catalog
+    medication_id (reminders created by update_medication), so both are matched. Orphans are
+    skipped here and deleted by the reaper; reminders without a medication_id (legacy data) are kept.
+    """
+    match = {"user_id": user_id}
+    if enabled_only:
+        match["enabled"] = True
+    
+    return db.medication_reminders.aggregate([
+        {"$match": match},
+        {"$lookup": {
+            "from": "user_medications",
+            "let": {"medication_id": "$medication_id"},
+            "pipeline": [
+                {"$match": {
+                    "user_id": user_id,
+                    "active": True,
+                    "$expr": REMINDER_MEDICATION_MATCH_EXPR
+                }},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "id": 1}}
+            ],
+            "as": "_medication"
+        }},
+        {"$match": {"$or": [
+            {"medication_id": {"$in": [None, ""]}},
+            {"_medication": {"$ne": []}}
+        ]}},
+        {"$unset": "_medication"},
+        *(stages or [])
+    ], batchSize=REMINDERS_BATCH_SIZE)
+
+def format_adherence_log(adherence_log: List[dict]) -> List[dict]:
+    """Render adherence_log dates as YYYY-MM-DD (entries logged before the switch are already strings)"""
+    return [
+        {**log, "date": log["date"].strftime("%Y-%m-%d")} if isinstance(log.get("date"), datetime) else log
+        for log in adherence_log
+    ]
+
+def iso_or_none(value):
+    """Stored timestamps are ISO strings, but some legacy documents hold BSON dates"""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def build_reminder_response(reminder: dict) -> MedicationReminder:
+    """Build a MedicationReminder from a stored document without re-validating it
+    
+    Legacy documents can lack fields or store dates as BSON dates, so every model field is
+    defaulted and converted here to keep the response schema model_construct can't enforce.
+    """
+    return MedicationReminder.model_construct(
+        id=reminder.get("id") or "",
+        user_id=reminder.get("user_id") or "",
+        medication_id=reminder.get("medication_id") or "",
+        medication_name=reminder.get("medication_name") or "",
+        reminder_times=reminder.get("reminder_times") or [],
+        enabled=is_reminder_enabled(reminder),
+        last_taken=iso_or_none(reminder.get("last_taken")),
+        adherence_log=format_adherence_log(reminder.get("adherence_log") or []),
+        created_at=iso_or_none(reminder.get("created_at")) or ""
+    )
+
 @api_router.post("/reminders")
 async def create_reminder(
     reminder_data: MedicationReminderCreate,
@@ -1698,7 +2315,7 @@ async def create_reminder(
     is_premium = current_user.get("is_premium", False)
     
     # Check reminder limit for free users
-    can_add = await check_reminder_limit(user_id, is_premium)
+    can_add = await check_reminder_limit(user_id, is_premium, current_user.get("active_reminder_count"))
     if not can_add:
         raise HTTPException(
             status_code=403,
@@ -1709,14 +2326,14 @@ async def create_reminder(
             }
         )
     
-    # Check if reminder already exists for this medication
-    existing = await db.medication_reminders.find_one({
-        "user_id": user_id,
-        "medication_id": reminder_data.medication_id
-    })
-    
-    if existing:
-        raise HTTPException(status_code=400, detail="Reminder already exists for this medication")
+    # Without the unique index (it failed to build on startup) nothing else stops a duplicate
+    if not reminder_unique_index_ready:
+        existing = await db.medication_reminders.find_one(
+            {"user_id": user_id, "medication_id": reminder_data.medication_id},
+            {"_id": 1}
+        )
+        if existing:
+            raise HTTPException(status_code=400, detail="Reminder already exists for this medication")
     
     reminder_dict = reminder_data.model_dump()
     reminder_dict["user_id"] = user_id
@@ -1725,7 +2342,12 @@ async def create_reminder(
     reminder_dict["adherence_log"] = []
     reminder_dict["created_at"] = datetime.now(timezone.utc).isoformat()
     
-    await db.medication_reminders.insert_one(reminder_dict)
+    # The unique (user_id, medication_id) index rejects a second reminder for the same medication
+    try:
+        await db.medication_reminders.insert_one(reminder_dict)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Reminder already exists for this medication")
+    await adjust_reminder_count(user_id, 1)
     
     return MedicationReminder(**reminder_dict)
 
@@ -1735,149 +2357,64 @@ async def get_reminders(current_user: dict = Depends(get_current_user)):
     """Get all reminders for current user (only for existing medications)"""
     user_id = current_user["id"]
     
-    # Clean up orphan reminders (reminders without medications)
-    all_reminders = await db.medication_reminders.find({"user_id": user_id}).to_list(None)
-    orphan_ids = []
-    
-    for reminder in all_reminders:
-        med_id = reminder.get("medication_id")
-        # Check if medication still exists
-        med_exists = await db.user_medications.find_one({
-            "medication_id": med_id,
-            "user_id": user_id,
-            "active": True
-        })
-        
-        if not med_exists:
-            orphan_ids.append(reminder.get("id"))
-    
-    # Delete orphan reminders
-    if orphan_ids:
-        await db.medication_reminders.delete_many({"id": {"$in": orphan_ids}})
-        logger.info(f"🧹 Cleaned up {len(orphan_ids)} orphan reminders for user {user_id}")
+    reminders = find_user_reminders(user_id, stages=[
+        # Only the most recent adherence entries are needed for the list; full history is served by /adherence
+        {"$set": {"adherence_log": {"$slice": [{"$ifNull": ["$adherence_log", []]}, -REMINDER_LIST_ADHERENCE_LOG_LIMIT]}}},
+        {"$project": {"_id": 0}}
+    ])
     
-    reminders = await db.medication_reminders.find({"user_id": user_id}, {"_id": 0}).to_list(length=None)
-    
-    # If no reminders, return empty list
-    if not reminders:
-        return []
+    # Stream the cursor instead of materializing every raw document first
+    return [build_reminder_response(reminder) async for reminder in reminders]
+
+
+@api_router.get("/reminders/upcoming")
+async def get_upcoming_reminders(current_user: dict = Depends(get_current_user)):
+    """Get upcoming reminders for today (only for existing medications)"""
+    user_id = current_user["id"]
     
-    # Get all medication IDs to verify they still exist
-    medication_ids = [r.get("medication_id") for r in reminders if r.get("medication_id")]
-    
-    # Only check if we have medication_ids to check
-    existing_med_ids = set()
-    if medication_ids:
-        existing_medications = await db.user_medications.find({
-            "user_id": user_id,
-            "id": {"$in": medication_ids}
-        }, {"_id": 0, "id": 1}).to_list(length=None)
-        
-        existing_med_ids = {med["id"] for med in existing_medications}
-    
-    # Track orphaned reminders to clean up (only if we found some existing medications)
-    orphaned_reminder_ids = []
-    valid_reminders = []
-    
-    for reminder in reminders:
-        medication_id = reminder.get("medication_id")
-        
-        # If no medication_id, keep the reminder (legacy data)
-        if not medication_id:
-            if "created_at" in reminder and isinstance(reminder["created_at"], datetime):
-                reminder["created_at"] = reminder["created_at"].isoformat()
-            valid_reminders.append(reminder)
-            continue
-        
-        # Only filter if we have existing medications to compare against
-        if medication_ids and existing_med_ids:
-            # Skip if medication doesn't exist anymore
-            if medication_id not in existing_med_ids:
-                orphaned_reminder_ids.append(reminder["id"])
-                continue
-        
-        # Convert datetime objects to ISO strings for Pydantic
-        if "created_at" in reminder and isinstance(reminder["created_at"], datetime):
-            reminder["created_at"] = reminder["created_at"].isoformat()
-        
-        valid_reminders.append(reminder)
-    
-    # Clean up orphaned reminders in background (only if we're sure they're orphaned)
-    if orphaned_reminder_ids and existing_med_ids:
-        await db.medication_reminders.delete_many({
-            "id": {"$in": orphaned_reminder_ids},
-            "user_id": user_id
-        })
-    
-    return [MedicationReminder(**reminder) for reminder in valid_reminders]
-
-
-@api_router.get("/reminders/upcoming")
-async def get_upcoming_reminders(current_user: dict = Depends(get_current_user)):
-    """Get upcoming reminders for today (only for existing medications)"""
-    user_id = current_user["id"]
-    
-    # Get all enabled reminders
-    reminders = await db.medication_reminders.find({
-        "user_id": user_id,
-        "enabled": True
-    }).to_list(length=None)
-    
-    # If no reminders, return empty list
-    if not reminders:
-        return {"upcoming_reminders": [], "date": datetime.now(timezone.utc).strftime("%Y-%m-%d")}
-    
-    # Get all medication IDs to verify they still exist
-    medication_ids = [r.get("medication_id") for r in reminders if r.get("medication_id")]
-    
-    # Only check if we have medication_ids to check
-    existing_med_ids = set()
-    if medication_ids:
-        existing_medications = await db.user_medications.find({
-            "user_id": user_id,
-            "id": {"$in": medication_ids}
-        }, {"_id": 0, "id": 1}).to_list(length=None)
-        
-        existing_med_ids = {med["id"] for med in existing_medications}
-    
-    # Get current time
-    now = datetime.now(timezone.utc)
-    current_time = now.strftime("%H:%M")
-    today_date = now.strftime("%Y-%m-%d")
-    
-    # Track orphaned reminders to clean up
-    orphaned_reminder_ids = []
+    # Get current time
+    now = datetime.now(timezone.utc)
+    current_time = now.strftime("%H:%M")
+    today_date = now.strftime("%Y-%m-%d")
+    today_day = adherence_day(now)
+    
+    # Get all enabled reminders whose medication still exists
+    reminders = find_user_reminders(user_id, enabled_only=True, stages=[
+        # Only the fields used below, with the adherence log narrowed to today's entries
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "medication_id": 1,
+            "medication_name": 1,
+            "reminder_times": 1,
+            "adherence_log": {"$filter": {
+                "input": {"$ifNull": ["$adherence_log", []]},
+                "as": "log",
+                "cond": {"$in": ["$$log.date", [today_day, today_date]]}
+            }}
+        }}
+    ])
     
     upcoming = []
-    for reminder in reminders:
+    # Stream the cursor instead of materializing every raw document first
+    async for reminder in reminders:
         medication_id = reminder.get("medication_id")
         
         # If no medication_id, skip for upcoming (shouldn't happen for new reminders)
         if not medication_id:
             continue
         
-        # Only filter if we have existing medications to compare against
-        should_skip = False
-        if medication_ids and existing_med_ids:
-            # Skip if medication doesn't exist anymore
-            if medication_id not in existing_med_ids:
-                orphaned_reminder_ids.append(reminder["id"])
-                should_skip = True
+        # Times already taken today, collected once per reminder (the log is already narrowed to today)
+        taken_today_times = {
+            log.get("time") for log in reminder.get("adherence_log", [])
+            if log.get("taken")
+        }
         
-        if should_skip:
-            continue
-            
         for reminder_time in reminder.get("reminder_times", []):
             # Check if this time hasn't passed yet today
             if reminder_time >= current_time:
                 # Check adherence log to see if already taken today
-                adherence_log = reminder.get("adherence_log", [])
-                taken_today = any(
-                    log.get("date") == today_date and 
-                    log.get("time") == reminder_time and 
-                    log.get("taken")
-                    for log in adherence_log
-                )
+                taken_today = reminder_time in taken_today_times
                 
                 upcoming.append({
                     "reminder_id": reminder["id"],
@@ -1887,13 +2424,6 @@ async def get_upcoming_reminders(current_user: dict = Depends(get_current_user))
                     "taken": taken_today
                 })
     
-    # Clean up orphaned reminders in background (only if we're sure they're orphaned)
-    if orphaned_reminder_ids and existing_med_ids:
-        await db.medication_reminders.delete_many({
-            "id": {"$in": orphaned_reminder_ids},
-            "user_id": user_id
-        })
-    
     # Sort by time
     upcoming.sort(key=lambda x: x["time"])
     
@@ -1909,15 +2439,6 @@ async def update_reminder(
     """Update reminder times or enable/disable"""
     user_id = current_user["id"]
     
-    # Find reminder
-    reminder = await db.medication_reminders.find_one({
-        "id": reminder_id,
-        "user_id": user_id
-    })
-    
-    if not reminder:
-        raise HTTPException(status_code=404, detail="Reminder not found")
-    
     # Update fields
     update_fields = {}
     if update_data.reminder_times is not None:
@@ -1925,16 +2446,28 @@ async def update_reminder(
     if update_data.enabled is not None:
         update_fields["enabled"] = update_data.enabled
     
+    reminder_filter = {"id": reminder_id, "user_id": user_id}
     if update_fields:
-        await db.medication_reminders.update_one(
-            {"id": reminder_id},
-            {"$set": update_fields}
+        # Update and fetch the prior state in one round-trip (needed to see enabled flips)
+        previous_reminder = await db.medication_reminders.find_one_and_update(
+            reminder_filter,
+            {"$set": update_fields},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
         )
+        if not previous_reminder:
+            raise HTTPException(status_code=404, detail="Reminder not found")
+        updated_reminder = {**previous_reminder, **update_fields}
+        was_enabled = is_reminder_enabled(previous_reminder)
+        if is_reminder_enabled(updated_reminder) != was_enabled:
+            await adjust_reminder_count(user_id, -1 if was_enabled else 1)
+    else:
+        updated_reminder = await db.medication_reminders.find_one(reminder_filter, {"_id": 0})
     
-    # Get updated reminder
-    updated_reminder = await db.medication_reminders.find_one({"id": reminder_id})
+    if not updated_reminder:
+        raise HTTPException(status_code=404, detail="Reminder not found")
     
-    return MedicationReminder(**updated_reminder)
+    return build_reminder_response(updated_reminder)
 
 
 @api_router.patch("/reminders/{reminder_id}/toggle")
@@ -1945,22 +2478,19 @@ async def toggle_reminder(
     """Toggle reminder enabled/disabled"""
     user_id = current_user["id"]
     
-    reminder = await db.medication_reminders.find_one({
-        "id": reminder_id,
-        "user_id": user_id
-    })
+    # Flip the flag server-side (pipeline update) so concurrent toggles can't race
+    reminder = await db.medication_reminders.find_one_and_update(
+        {"id": reminder_id, "user_id": user_id},
+        [{"$set": {"enabled": {"$not": [{"$ifNull": ["$enabled", True]}]}}}],
+        projection={"_id": 0, "enabled": 1},
+        return_document=ReturnDocument.AFTER
+    )
     
     if not reminder:
         raise HTTPException(status_code=404, detail="Reminder not found")
+    await adjust_reminder_count(user_id, 1 if reminder["enabled"] else -1)
     
-    new_enabled = not reminder.get("enabled", True)
-    
-    await db.medication_reminders.update_one(
-        {"id": reminder_id},
-        {"$set": {"enabled": new_enabled}}
-    )
-    
-    return {"enabled": new_enabled}
+    return {"enabled": reminder["enabled"]}
 
 
 @api_router.delete("/reminders/{reminder_id}")
@@ -1971,13 +2501,15 @@ async def delete_reminder(
     """Delete a reminder"""
     user_id = current_user["id"]
     
-    result = await db.medication_reminders.delete_one({
-        "id": reminder_id,
-        "user_id": user_id
-    })
+    reminder = await db.medication_reminders.find_one_and_delete(
+        {"id": reminder_id, "user_id": user_id},
+        projection={"_id": 0, "enabled": 1}
+    )
     
-    if result.deleted_count == 0:
+    if reminder is None:
         raise HTTPException(status_code=404, detail="Reminder not found")
+    if is_reminder_enabled(reminder):
+        await adjust_reminder_count(user_id, -1)
     
     return {"message": "Reminder deleted successfully"}
 
@@ -1990,50 +2522,49 @@ async def mark_dose_taken(
     """Mark a dose as taken"""
     user_id = current_user["id"]
     
-    # Find reminder
-    reminder = await db.medication_reminders.find_one({
-        "id": dose_data.reminder_id,
-        "user_id": user_id
-    })
-    
-    if not reminder:
-        raise HTTPException(status_code=404, detail="Reminder not found")
-    
     # Parse taken time
     taken_dt = datetime.fromisoformat(dose_data.taken_time.replace('Z', '+00:00'))
-    taken_date = taken_dt.strftime("%Y-%m-%d")
+    taken_day = adherence_day(taken_dt)
     taken_time = taken_dt.strftime("%H:%M")
     
-    # Add to adherence log
-    adherence_log = reminder.get("adherence_log", [])
+    reminder_filter = {"id": dose_data.reminder_id, "user_id": user_id}
+    # Match entries logged as a date string (older data) as well as a BSON date
+    slot = {"date": {"$in": [taken_day, taken_dt.strftime("%Y-%m-%d")]}, "time": taken_time}
     
-    # Check if already logged for this date/time
-    existing_log = next((log for log in adherence_log 
-                        if log.get("date") == taken_date and log.get("time") == taken_time), None)
+    async def mark_existing_log():
+        # Update the existing log entry for this date/time in place
+        return await db.medication_reminders.find_one_and_update(
+            {**reminder_filter, "adherence_log": {"$elemMatch": slot}},
+            {"$set": {
+                "adherence_log.$.taken": True,
+                "adherence_log.$.actual_time": dose_data.taken_time,
+                "last_taken": dose_data.taken_time
+            }},
+            projection={"_id": 0, "adherence_log": 1},
+            return_document=ReturnDocument.AFTER
+        )
     
-    if existing_log:
-        # Update existing log
-        existing_log["taken"] = True
-        existing_log["actual_time"] = dose_data.taken_time
-    else:
-        # Add new log entry
-        adherence_log.append({
-            "date": taken_date,
-            "time": taken_time,
-            "taken": True,
-            "actual_time": dose_data.taken_time
-        })
+    # Atomic updates instead of rewriting the whole log from Python
+    reminder = await mark_existing_log()
+    if not reminder:
+        # Add new log entry (guarded so a concurrent request can't log the same slot twice)
+        reminder = await db.medication_reminders.find_one_and_update(
+            {**reminder_filter, "adherence_log": {"$not": {"$elemMatch": slot}}},
+            {
+                "$push": {"adherence_log": {"date": taken_day, "time": taken_time, "taken": True, "actual_time": dose_data.taken_time}},
+                "$set": {"last_taken": dose_data.taken_time}
+            },
+            projection={"_id": 0, "adherence_log": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    if not reminder:
+        # Slot was logged concurrently between the two updates
+        reminder = await mark_existing_log()
     
-    # Update reminder
-    await db.medication_reminders.update_one(
-        {"id": dose_data.reminder_id},
-        {
-            "$set": {
-                "adherence_log": adherence_log,
-                "last_taken": dose_data.taken_time
-            }
-        }
-    )
+    if not reminder:
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    
+    adherence_log = format_adherence_log(reminder.get("adherence_log", []))
     
     return {"message": "Dose marked as taken", "adherence_log": adherence_log}
 
@@ -2047,25 +2578,39 @@ async def get_adherence_stats(
     """Get adherence statistics for a reminder"""
     user_id = current_user["id"]
     
-    reminder = await db.medication_reminders.find_one({
-        "id": reminder_id,
-        "user_id": user_id
-    })
-    
-    if not reminder:
+    # Count taken doses in last N days inside MongoDB instead of shipping the whole log
+    cutoff_dt = datetime.now(timezone.utc) - timedelta(days=days)
+    cutoff_day = adherence_day(cutoff_dt)
+    cutoff_date = cutoff_dt.strftime("%Y-%m-%d")
+    results = await db.medication_reminders.aggregate([
+        {"$match": {"id": reminder_id, "user_id": user_id}},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 0,
+            "medication_name": 1,
+            "reminder_times_count": {"$size": {"$ifNull": ["$reminder_times", []]}},
+            "taken_doses": {"$size": {"$filter": {
+                "input": {"$ifNull": ["$adherence_log", []]},
+                "as": "log",
+                "cond": {"$and": [
+                    {"$eq": ["$$log.taken", True]},
+                    {"$or": [
+                        # BSON dates compare as dates; legacy string dates compare as strings
+                        {"$and": [{"$eq": [{"$type": "$$log.date"}, "date"]}, {"$gte": ["$$log.date", cutoff_day]}]},
+                        {"$and": [{"$eq": [{"$type": "$$log.date"}, "string"]}, {"$gte": ["$$log.date", cutoff_date]}]}
+                    ]}
+                ]}
+            }}}
+        }}
+    ]).to_list(length=1)
+    
+    if not results:
         raise HTTPException(status_code=404, detail="Reminder not found")
-    
-    # Calculate adherence for last N days
-    adherence_log = reminder.get("adherence_log", [])
-    reminder_times = reminder.get("reminder_times", [])
+    reminder = results[0]
     
     # Calculate expected doses
-    expected_doses = days * len(reminder_times)
-    
-    # Count taken doses in last N days
-    cutoff_date = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
-    taken_doses = sum(1 for log in adherence_log 
-                     if log.get("taken") and log.get("date") >= cutoff_date)
+    expected_doses = days * reminder["reminder_times_count"]
+    taken_doses = reminder["taken_doses"]
     
     adherence_rate = (taken_doses / expected_doses * 100) if expected_doses > 0 else 0
     
@@ -2127,6 +2672,16 @@ async def analyze_medication_course(
         return MedicationCourseAnalysis(**fallback_medication_analysis(request.medication_name, request.active_ingredient))
 
 
+# Shared OpenFDA client so repeated label lookups reuse pooled (HTTP/2) connections
+fda_client = httpx.AsyncClient(
+    timeout=10.0,
+    http2=True,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+)
+
+# FDA label analysis per (medication name, active ingredient); label data rarely changes
+fda_course_info_cache = TTLCache(maxsize=2048, ttl=86400)
+
 async def query_fda_for_course_info(
     medication_name: str,
     active_ingredient: Optional[str],
@@ -2135,9 +2690,11 @@ async def query_fda_for_course_info(
     """
     Query FDA OpenFDA API for medication course information
     """
+    cache_key = (medication_name.strip().lower(), (active_ingredient or "").strip().lower())
+    if cache_key in fda_course_info_cache:
+        return fda_course_info_cache[cache_key]
+    
     try:
-        import httpx
-        
         # Prepare search query
         search_parts = []
         
@@ -2174,37 +2731,71 @@ async def query_fda_for_course_info(
         
         print(f"🔍 Querying FDA API: {fda_url}")
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(fda_url)
-            
-            if response.status_code != 200:
-                print(f"FDA API returned status {response.status_code}")
-                return None
-            
-            data = response.json()
-            
-            if not data.get('results'):
-                print(f"No FDA results found for {medication_name}")
-                return None
-            
-            result = data['results'][0]
-            
-            # Extract dosage and administration info
-            dosage_info = result.get('dosage_and_administration', [''])[0] if result.get('dosage_and_administration') else ''
-            indications = result.get('indications_and_usage', [''])[0] if result.get('indications_and_usage') else ''
-            
-            # Analyze the text to determine course duration
-            analysis = analyze_fda_label_text(dosage_info, indications, medication_name, active_ingredient)
-            
-            print(f"✅ FDA analysis complete: {analysis.get('category')} - {analysis.get('recommended_duration')} days")
-            
-            return analysis
-            
+        response = await fda_client.get(fda_url)
+        
+        if response.status_code != 200:
+            print(f"FDA API returned status {response.status_code}")
+            return None
+        
+        data = response.json()
+        
+        if not data.get('results'):
+            print(f"No FDA results found for {medication_name}")
+            fda_course_info_cache[cache_key] = None
+            return None
+        
+        result = data['results'][0]
+        
+        # Extract dosage and administration info
+        dosage_info = result.get('dosage_and_administration', [''])[0] if result.get('dosage_and_administration') else ''
+        indications = result.get('indications_and_usage', [''])[0] if result.get('indications_and_usage') else ''
+        
+        # Analyze the text to determine course duration
+        analysis = analyze_fda_label_text(dosage_info, indications, medication_name, active_ingredient)
+        
+        print(f"✅ FDA analysis complete: {analysis.get('category')} - {analysis.get('recommended_duration')} days")
+        
+        fda_course_info_cache[cache_key] = analysis
+        return analysis
+        
     except Exception as e:
         print(f"Error querying FDA API: {e}")
         return None
 
 
+def keyword_pattern(keywords: List[str]) -> re.Pattern:
+    """Compile a keyword list into one alternation (plain substring match, like `k in text`)"""
+    return re.compile("|".join(re.escape(k) for k in keywords))
+
+# Keyword patterns for FDA label analysis, compiled once at import
+FDA_PAINKILLER_RE = keyword_pattern(['pain', 'analgesic', 'paracetamol', 'acetaminophen', 'ibuprofen', 'aspirin', 'naproxen'])
+FDA_ANTIBIOTIC_RE = keyword_pattern(['antibiotic', 'amoxicillin', 'penicillin', 'cephalosporin', 'azithromycin', 'infection', 'bacterial'])
+FDA_CHRONIC_RE = keyword_pattern(['chronic', 'maintenance', 'long-term', 'daily', 'blood pressure', 'diabetes', 'cholesterol'])
+
+# Single-pass scanner over the label text: every category and duration pattern is an alternative
+# inside a lookahead, so matches may overlap and each pattern sees every position, as with separate searches
+FDA_LABEL_SCAN_RE = re.compile("(?=" + "|".join([
+    f"(?P<painkiller>{FDA_PAINKILLER_RE.pattern})",
+    f"(?P<antibiotic>{FDA_ANTIBIOTIC_RE.pattern})",
+    f"(?P<chronic>{FDA_CHRONIC_RE.pattern})",
+    r"(?P<days>(?P<days_n>\d+)\s*day)",
+    r"(?P<weeks>(?P<weeks_n>\d+)\s*week)",
+    r"(?P<days_range>\d+\s*to\s*(?P<days_range_max>\d+)\s*day)",
+    r"(?P<for_days>for\s*(?P<for_days_n>\d+))"
+]) + ")")
+
+def scan_fda_label_text(text: str) -> dict:
+    """Scan label text once and return the first match for each FDA_LABEL_SCAN_RE group"""
+    found = {}
+    for match in FDA_LABEL_SCAN_RE.finditer(text):
+        found.setdefault(match.lastgroup, match)
+    return found
+
+# Keyword patterns for the offline fallback analysis (English and Arabic names)
+FALLBACK_PAINKILLER_RE = keyword_pattern(['paracetamol', 'ibuprofen', 'aspirin', 'panadol', 'brufen', 'voltaren', 'diclofenac', 'مسكن', 'باراسيتامول', 'ايبوبروفين'])
+FALLBACK_ANTIBIOTIC_RE = keyword_pattern(['antibiotic', 'amoxicillin', 'augmentin', 'azithromycin', 'cephalexin', 'ciprofloxacin', 'مضاد حيوي', 'اوجمنتين', 'اموكسيسيلين'])
+FALLBACK_CHRONIC_RE = keyword_pattern(['blood pressure', 'diabetes', 'cholesterol', 'thyroid', 'ضغط', 'سكر', 'كوليسترول', 'الغدة'])
+
 def analyze_fda_label_text(dosage_text: str, indications_text: str, med_name: str, active_ingredient: Optional[str]) -> dict:
     """
     Analyze FDA label text to extract course duration
@@ -2212,9 +2803,10 @@ def analyze_fda_label_text(dosage_text: str, indications_text: str, med_name: st
     combined_text = (dosage_text + " " + indications_text).lower()
     med_lower = (med_name + " " + (active_ingredient or "")).lower()
     
+    found = scan_fda_label_text(combined_text)
+    
     # Check for painkillers/analgesics
-    painkillers = ['pain', 'analgesic', 'paracetamol', 'acetaminophen', 'ibuprofen', 'aspirin', 'naproxen']
-    if any(p in med_lower for p in painkillers) or any(p in combined_text for p in painkillers):
+    if FDA_PAINKILLER_RE.search(med_lower) or "painkiller" in found:
         return {
             "is_as_needed": True,
             "recommended_duration": None,
@@ -2225,32 +2817,21 @@ def analyze_fda_label_text(dosage_text: str, indications_text: str, med_name: st
             "usage_note_ar": "تناول فقط عند الحاجة للألم أو الحمى. لا تستخدم بشكل منتظم دون استشارة طبية."
         }
     
-    # Extract duration from FDA text
-    duration_patterns = [
-        (r'(\d+)\s*day', 'days'),
-        (r'(\d+)\s*week', 'weeks'),
-        (r'(\d+)\s*to\s*(\d+)\s*day', 'days_range'),
-        (r'for\s*(\d+)', 'days')
-    ]
-    
-    import re
+    # Extract duration from FDA text (patterns in priority order)
     recommended_duration = None
     
-    for pattern, unit in duration_patterns:
-        match = re.search(pattern, combined_text)
-        if match:
-            if unit == 'days_range':
-                # Take the maximum of the range
-                recommended_duration = int(match.group(2))
-            elif unit == 'weeks':
-                recommended_duration = int(match.group(1)) * 7
-            else:
-                recommended_duration = int(match.group(1))
-            break
+    if "days" in found:
+        recommended_duration = int(found["days"].group("days_n"))
+    elif "weeks" in found:
+        recommended_duration = int(found["weeks"].group("weeks_n")) * 7
+    elif "days_range" in found:
+        # Take the maximum of the range
+        recommended_duration = int(found["days_range"].group("days_range_max"))
+    elif "for_days" in found:
+        recommended_duration = int(found["for_days"].group("for_days_n"))
     
     # Check for antibiotics
-    antibiotics = ['antibiotic', 'amoxicillin', 'penicillin', 'cephalosporin', 'azithromycin', 'infection', 'bacterial']
-    is_antibiotic = any(a in med_lower for a in antibiotics) or any(a in combined_text for a in antibiotics)
+    is_antibiotic = bool(FDA_ANTIBIOTIC_RE.search(med_lower)) or "antibiotic" in found
     
     if is_antibiotic:
         if not recommended_duration:
@@ -2266,8 +2847,7 @@ def analyze_fda_label_text(dosage_text: str, indications_text: str, med_name: st
         }
     
     # Check for chronic medications
-    chronic_keywords = ['chronic', 'maintenance', 'long-term', 'daily', 'blood pressure', 'diabetes', 'cholesterol']
-    is_chronic = any(c in combined_text for c in chronic_keywords)
+    is_chronic = "chronic" in found
     
     if is_chronic:
         return {
@@ -2347,29 +2927,23 @@ Guidelines:
         api_key = os.environ.get('OPENAI_API_KEY') or os.environ.get('EMERGENT_LLM_KEY')
         client = AsyncOpenAI(api_key=api_key)
         
-        response = await client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a clinical pharmacist expert."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=500
-        )
+        async with openai_semaphore:
+            response = await client.chat.completions.create(
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "You are a clinical pharmacist expert."},
+                    {"role": "user", "content": prompt}
+                ],
+                temperature=0.3,
+                max_tokens=500,
+                response_format={"type": "json_object"}
+            )
         
         response_text = response.choices[0].message.content
         
-        # Parse JSON from response
+        # JSON mode guarantees a JSON object, so parse it directly
         try:
-            # Find JSON in response
-            json_start = response_text.find('{')
-            json_end = response_text.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                json_str = response_text[json_start:json_end]
-                analysis_data = json.loads(json_str)
-            else:
-                # Fallback analysis based on keywords
-                analysis_data = fallback_medication_analysis(request.medication_name, request.active_ingredient)
+            analysis_data = orjson.loads(response_text)
         except Exception as e:
             print(f"Error parsing AI response: {e}")
             # Fallback analysis
@@ -2390,8 +2964,7 @@ def fallback_medication_analysis(medication_name: str, active_ingredient: Option
     med_lower = (medication_name + " " + (active_ingredient or "")).lower()
     
     # Check for painkillers
-    painkillers = ['paracetamol', 'ibuprofen', 'aspirin', 'panadol', 'brufen', 'voltaren', 'diclofenac', 'مسكن', 'باراسيتامول', 'ايبوبروفين']
-    if any(p in med_lower for p in painkillers):
+    if FALLBACK_PAINKILLER_RE.search(med_lower):
         return {
             "is_as_needed": True,
             "recommended_duration": None,
@@ -2403,8 +2976,7 @@ def fallback_medication_analysis(medication_name: str, active_ingredient: Option
         }
     
     # Check for antibiotics
-    antibiotics = ['antibiotic', 'amoxicillin', 'augmentin', 'azithromycin', 'cephalexin', 'ciprofloxacin', 'مضاد حيوي', 'اوجمنتين', 'اموكسيسيلين']
-    if any(a in med_lower for a in antibiotics):
+    if FALLBACK_ANTIBIOTIC_RE.search(med_lower):
         return {
             "is_as_needed": False,
             "recommended_duration": 7,
@@ -2416,8 +2988,7 @@ def fallback_medication_analysis(medication_name: str, active_ingredient: Option
         }
     
     # Check for chronic medications
-    chronic_keywords = ['blood pressure', 'diabetes', 'cholesterol', 'thyroid', 'ضغط', 'سكر', 'كوليسترول', 'الغدة']
-    if any(c in med_lower for c in chronic_keywords):
+    if FALLBACK_CHRONIC_RE.search(med_lower):
         return {
             "is_as_needed": False,
             "recommended_duration": 30,
@@ -2439,6 +3010,25 @@ def fallback_medication_analysis(medication_name: str, active_ingredient: Option
         "usage_note_ar": "تناول حسب وصف مقدم الرعاية الصحية."
     }
 
+async def search_medications_page(search_filter: dict, limit: int, rank_by_text_score: bool = False):
+    """Return (first `limit` matches, total matches) for a medications search in one aggregation"""
+    # No hint: each $or clause is planned against its own *_lower / Arabic field index, and
+    # forcing one index would turn the prefix fallback back into a full index scan
+    pipeline = [{"$match": search_filter}]
+    results_stages = [{"$limit": limit}, {"$project": SFDA_SEARCH_RESULT_PROJECTION}]
+    if rank_by_text_score:
+        pipeline.append({"$addFields": {"_score": {"$meta": "textScore"}}})
+        results_stages = [{"$sort": {"_score": -1}}, {"$limit": limit}, {"$project": {**SFDA_SEARCH_RESULT_PROJECTION, "_score": 0}}]
+    
+    # $facet evaluates the filter once for both the page and the count
+    pipeline.append({"$facet": {
+        "results": results_stages,
+        "total": [{"$count": "n"}]
+    }})
+    page = (await db.medications.aggregate(pipeline).to_list(length=1))[0]
+    total = page["total"][0]["n"] if page["total"] else 0
+    return page["results"], total
+
 @api_router.get("/sfda-medications/search")
 async def search_sfda_medications(
     query: str,
@@ -2450,7 +3040,8 @@ async def search_sfda_medications(
         user_id = current_user["id"]
         is_premium = current_user.get("is_premium", False)
         
-        if not query or len(query) < 2:
+        query = ARABIC_DIACRITICS_RE.sub("", query or "").strip()
+        if len(query) < 2:
             return {
                 "success": True,
                 "results": [],
@@ -2458,63 +3049,55 @@ async def search_sfda_medications(
                 "message": "Query too short"
             }
         
-        # Check search limit for free users
-        current_searches = current_user.get("sfda_searches_used", 0)
-        can_search = await check_sfda_search_limit(user_id, is_premium, current_searches)
-        
-        if not can_search:
-            raise HTTPException(
-                status_code=403,
-                detail={
-                    "error": "search_limit_reached",
-                    "message": f"Free users can only perform {FREE_USER_LIMITS['max_sfda_searches']} SFDA searches. Upgrade to Premium for unlimited searches.",
-                    "limit": FREE_USER_LIMITS["max_sfda_searches"],
-                    "used": current_searches
-                }
-            )
-        
-        query_lower = query.lower()
-        
-        # Search in trade name (English & Arabic), scientific name, active ingredients, and manufacturer
-        search_filter = {
-            "$or": [
-                {"trade_name": {"$regex": query, "$options": "i"}},
-                {"trade_name_ar": {"$regex": query, "$options": "i"}},
-                {"commercial_name_en": {"$regex": query, "$options": "i"}},
-                {"commercial_name_ar": {"$regex": query, "$options": "i"}},
-                {"scientific_name": {"$regex": query, "$options": "i"}},
-                {"scientific_name_ar": {"$regex": query, "$options": "i"}},
-                {"active_ingredients": {"$regex": query, "$options": "i"}},
-                {"manufacturer": {"$regex": query, "$options": "i"}},
-                {"manufacturer_ar": {"$regex": query, "$options": "i"}}
-            ]
-        }
-        
-        # Get total count
-        total = await db.medications.count_documents(search_filter)
-        
-        # Get results
-        cursor = db.medications.find(
-            search_filter,
-            {"_id": 0}
-        ).limit(limit)
-        
-        results = await cursor.to_list(length=limit)
+        # Check search limit for free users only (premium users skip all counter work); the search
+        # is counted in memory up front so concurrent requests cannot overshoot the limit, and
+        # handed back below if nothing is found
+        current_searches = 0
+        if not is_premium:
+            can_search, current_searches = reserve_sfda_search(user_id, current_user.get("sfda_searches_used", 0))
+            
+            if not can_search:
+                raise HTTPException(
+                    status_code=403,
+                    detail={
+                        "error": "search_limit_reached",
+                        "message": f"Free users can only perform {MAX_SFDA_SEARCHES} SFDA searches. Upgrade to Premium for unlimited searches.",
+                        "limit": MAX_SFDA_SEARCHES,
+                        "used": current_searches
+                    }
+                )
         
-        # Increment search counter for free users (only if results found)
-        if not is_premium and len(results) > 0:
-            await db.users.update_one(
-                {"id": user_id},
-                {"$inc": {"sfda_searches_used": 1}}
+        results = []
+        try:
+            # Whole-word matches come from the weighted text index, best matches first
+            results, total = await search_medications_page(
+                {"$text": {"$search": query}}, limit, rank_by_text_score=True
             )
-        
-        return {
+            if not total:
+                # Partial words (search-as-you-type) fall back to an anchored prefix match on the
+                # fields of the query's script; without $options "i" each clause is an index range scan
+                if ARABIC_LETTER_RE.search(query):
+                    prefix = re.escape(query)
+                    clauses = [{field: {"$regex": f"^{prefix}"}} for field in SFDA_SEARCH_ARABIC_FIELDS]
+                else:
+                    prefix_lower = re.escape(query.lower())
+                    clauses = [{f"{field}_lower": {"$regex": f"^{prefix_lower}"}} for field in SFDA_SEARCH_LATIN_FIELDS]
+                search_filter = {"$or": clauses}
+                
+                results, total = await search_medications_page(search_filter, limit)
+        finally:
+            # Only searches that found results count against free users
+            if not is_premium:
+                settle_sfda_search(user_id, found=len(results) > 0)
+        
+        # Plain JSON-native dict: serialize directly, skipping FastAPI's jsonable_encoder pass
+        return ORJSONResponse({
             "success": True,
             "results": results,
             "total": total,
             "showing": len(results),
-            "searches_remaining": FREE_USER_LIMITS["max_sfda_searches"] - current_searches - 1 if not is_premium else None
-        }
+            "searches_remaining": MAX_SFDA_SEARCHES - current_searches - 1 if not is_premium else None
+        })
         
     except HTTPException:
         raise
@@ -2530,18 +3113,12 @@ async def get_sfda_medication_details(
 ):
     """Get detailed information about a specific medication from SFDA database"""
     try:
+        # Case-insensitive match through the indexed lowercase shadow field
         medication = await db.sfda_medications.find_one(
-            {"trade_name": trade_name},
+            {"trade_name_lower": trade_name.strip().lower()},
             {"_id": 0}
         )
         
-        if not medication:
-            # Try case-insensitive search
-            medication = await db.sfda_medications.find_one(
-                {"trade_name": {"$regex": f"^{trade_name}$", "$options": "i"}},
-                {"_id": 0}
-            )
-        
         if medication:
             return {
                 "success": True,
@@ -2557,6 +3134,223 @@ async def get_sfda_medication_details(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Only the SFDA fields /ai/drug-info reads
+AI_DRUG_INFO_SFDA_PROJECTION = {
+    "_id": 0, "trade_name": 1, "trade_name_ar": 1, "package_size": 1, "strength": 1,
+    "strength_unit": 1, "dosage_form": 1, "dosage_form_ar": 1, "price_sar": 1,
+    "legal_status": 1, "legal_status_ar": 1, "dosage_form_class": 1
+}
+
+# Dosage / package parsing patterns for /ai/drug-info, compiled once at import
+DRUG_PACKAGE_SIZE_RE = re.compile(r'(\d+\.?\d*)\s*(g|gm|gram|ml|mg|ملغ|مجم|جم)', re.IGNORECASE)
+DOSAGE_EVERY_HOURS_RE = re.compile(r'كل\s*(\d+)(?:-\d+)?\s*ساعات?')
+DOSAGE_TIMES_TEXT_RE = re.compile(r'(five|four|three|two|one|six|seven|eight)\s+times', re.IGNORECASE)
+DOSAGE_DURATION_RE = re.compile(r'(?:for|لمدة)\s+(one|two|three|four|five|six|seven|eight|nine|ten|\d+)\s+(day|days|يوم|أيام)', re.IGNORECASE)
+DOSAGE_TWO_PILLS_RE = re.compile(r'حبتين|حبتان|two tablets?', re.IGNORECASE)
+# Frequency phrases in priority order (dicts keep insertion order)
+DOSAGE_TIMES_PER_DAY = {
+    "مرتين": 2, "twice": 2,
+    "ثلاث مرات": 3, "three times": 3,
+    "أربع مرات": 4, "four times": 4,
+    "مرة واحدة": 1, "once": 1
+}
+DOSAGE_TEXT_NUMBERS = {
+    'five': 5, 'four': 4, 'three': 3, 'two': 2, 'one': 1,
+    'six': 6, 'seven': 7, 'eight': 8
+}
+
+# Full /ai/drug-info responses per (search name, scientific name, language)
+ai_medication_info_cache = TTLCache(maxsize=5000, ttl=600)
+ai_medication_info_inflight = {}  # cache_key -> task fetching that response
+
+async def find_ai_drug_info_sfda_match(search_name: str, scientific_name: Optional[str]) -> Optional[dict]:
+    """Match a drug name against the SFDA database for package size and accurate info"""
+    # Anchored prefixes on search_tokens (lowercased trade name and active ingredients, one
+    # multikey index); a scientific name equal to the search name adds no second prefix
+    prefixes = {search_name.lower().strip(), (scientific_name or search_name).lower().strip()}
+    query = {"search_tokens": {"$in": [re.compile("^" + re.escape(prefix)) for prefix in prefixes]}}
+    try:
+        return await db.sfda_medications.find_one(query, AI_DRUG_INFO_SFDA_PROJECTION)
+    except Exception as e:
+        logging.error(f"Error matching with SFDA database: {str(e)}")
+        return None
+
+async def fetch_ai_medication_info(drug_name: Optional[str], scientific_name: Optional[str], search_name: str, language: str) -> dict:
+    """Build the /ai/drug-info response: AI drug information enriched with the SFDA match"""
+    # The SFDA lookup only needs search_name, so it runs while the AI call is in flight
+    result, sfda_match = await asyncio.gather(
+        ai_drug_info.get_drug_info_async(
+            drug_name=search_name,
+            scientific_name=scientific_name if scientific_name != drug_name else None,
+            language=language
+        ),
+        find_ai_drug_info_sfda_match(search_name, scientific_name)
+    )
+    
+    if not result.get("success"):
+        return {
+            "success": False,
+            "message": "Could not get information from AI",
+            "error": result.get("error", "Unknown error")
+        }
+    
+    treatment_duration_days = None
+    
+    try:
+        # Extract package size from drug name if not in SFDA or SFDA has wrong size
+        # (drug_name is None when only scientific_name was given)
+        name_for_size = drug_name or ""
+        package_size_from_name = None
+        size_match = DRUG_PACKAGE_SIZE_RE.search(name_for_size)
+        if size_match:
+            size_value = float(size_match.group(1))
+            size_unit = size_match.group(2).lower()
+            # Normalize units to grams or ml
+            if size_unit in ['g', 'gm', 'gram', 'جم']:
+                package_size_from_name = size_value
+            elif size_unit in ['ml']:
+                package_size_from_name = size_value
+            elif size_unit in ['mg', 'ملغ', 'مجم']:
+                package_size_from_name = size_value / 1000  # Convert mg to g
+        
+        if sfda_match or package_size_from_name:
+            # Calculate treatment duration based on dosage and package size
+            dosage_text = result.get("dosage", "")
+            
+            # Use package size from name if available and SFDA is unreliable (< 2)
+            package_size = package_size_from_name if package_size_from_name and (not sfda_match or sfda_match.get("package_size", 0) < 2) else sfda_match.get("package_size", 0) if sfda_match else 0
+            
+            if package_size and dosage_text:
+                # Parse dosage to extract times per day
+                times_per_day = 1  # Default
+                
+                # Arabic / English frequency phrases, first match wins
+                dosage_lower = dosage_text.lower()
+                times_per_day = next(
+                    (times for phrase, times in DOSAGE_TIMES_PER_DAY.items() if phrase in dosage_lower),
+                    times_per_day
+                )
+                
+                # Check for "every X hours" pattern
+                hours_match = DOSAGE_EVERY_HOURS_RE.search(dosage_text)
+                if hours_match:
+                    hours = int(hours_match.group(1))
+                    times_per_day = 24 // hours
+                
+                # Check for text numbers (five times, four days, etc.)
+                times_text_match = DOSAGE_TIMES_TEXT_RE.search(dosage_text)
+                if times_text_match:
+                    times_per_day = DOSAGE_TEXT_NUMBERS.get(times_text_match.group(1).lower(), times_per_day)
+                
+                # Extract treatment duration in days
+                duration_days = None
+                duration_text_match = DOSAGE_DURATION_RE.search(dosage_text)
+                if duration_text_match:
+                    duration_num = duration_text_match.group(1).lower()
+                    if duration_num.isdigit():
+                        duration_days = int(duration_num)
+                    else:
+                        duration_days = DOSAGE_TEXT_NUMBERS.get(duration_num, 1)
+                
+                # Calculate pills per time (default 1 unless specified)
+                pills_per_time = 1
+                pills_match = DOSAGE_TWO_PILLS_RE.search(dosage_text)
+                if pills_match:
+                    pills_per_time = 2
+                
+                # For topical medications (creams, ointments), assume 1g per application
+                # (SFDA entries carry a precomputed dosage_form_class; otherwise classify the name)
+                dosage_form = (sfda_match.get('dosage_form', '') if sfda_match else '') or name_for_size
+                dosage_form_class = (sfda_match or {}).get('dosage_form_class') or classify_dosage_form(dosage_form)
+                is_topical = dosage_form_class == "topical"
+                
+                logging.info(f"Checking topical: is_topical={is_topical}, package_size_from_name={package_size_from_name}, duration_days={duration_days}, dosage_form={dosage_form}")
+                
+                if is_topical and package_size_from_name and duration_days:
+                    # For topical: calculate based on grams/ml
+                    # Assume 1g or 1ml per application
+                    grams_per_application = 1.0
+                    total_applications = times_per_day * duration_days
+                    total_grams_needed = total_applications * grams_per_application
+                    
+                    # Calculate number of packages needed
+                    packages_needed = math.ceil(total_grams_needed / package_size_from_name)
+                    
+                    # Treatment duration = total days
+                    treatment_duration_days = duration_days
+                    
+                    logging.info(f"Topical medication {search_name}: {packages_needed} package(s) needed for {duration_days} days (package: {package_size_from_name}g, {times_per_day}x daily)")
+                else:
+                    # For tablets/capsules: regular calculation
+                    daily_usage = times_per_day * pills_per_time
+                    
+                    # Calculate treatment duration
+                    if daily_usage > 0:
+                        treatment_duration_days = int(package_size / daily_usage)
+                        
+                        logging.info(f"Calculated treatment duration for {search_name}: {treatment_duration_days} days (package: {package_size}, daily: {daily_usage})")
+    
+    except Exception as e:
+        logging.error(f"Error calculating treatment duration from SFDA data: {str(e)}")
+    
+    response_data = {
+        "classification": result.get("classification", ""),
+        "uses": result.get("uses", ""),
+        "dosage": result.get("dosage", ""),
+        "warnings": result.get("warnings", ""),
+        "pregnancy_lactation": result.get("pregnancy_lactation", ""),
+        "source": "AI (OpenAI GPT-4)",
+        "search_term": result.get("search_term", "")
+    }
+    
+    # Add SFDA info if matched
+    if sfda_match:
+        legal_status = sfda_match.get("legal_status", "").lower()
+        is_prescription = "prescription" in legal_status
+        
+        response_data["sfda_match"] = {
+            "trade_name": sfda_match.get("trade_name", ""),
+            "trade_name_ar": sfda_match.get("trade_name_ar", ""),
+            "package_size": sfda_match.get("package_size", 0),
+            "strength": sfda_match.get("strength", ""),
+            "strength_unit": sfda_match.get("strength_unit", ""),
+            "dosage_form": sfda_match.get("dosage_form", ""),
+            "dosage_form_ar": sfda_match.get("dosage_form_ar", ""),
+            "price_sar": sfda_match.get("price_sar", 0),
+            "legal_status": sfda_match.get("legal_status", ""),
+            "legal_status_ar": sfda_match.get("legal_status_ar", ""),
+            "is_prescription": is_prescription
+        }
+        
+        if treatment_duration_days:
+            response_data["sfda_match"]["calculated_treatment_duration_days"] = treatment_duration_days
+        
+        # Add prescription warning if applicable
+        if is_prescription:
+            response_data["prescription_warning"] = {
+                "ar": "⚠️ هذا الدواء يحتاج وصفة طبية. الجرعات تختلف باختلاف الحالة الطبية ودائماً يجب الرجوع للطبيب المعالج.",
+                "en": "⚠️ This medication requires a prescription. Dosages vary depending on the medical condition and you should always consult your treating physician."
+            }
+    
+    return {
+        "success": True,
+        "data": response_data
+    }
+
+async def fetch_and_cache_ai_medication_info(
+    cache_key: tuple,
+    drug_name: Optional[str],
+    scientific_name: Optional[str],
+    search_name: str,
+    language: str
+) -> dict:
+    """Fetch AI drug info and cache successful responses"""
+    response = await fetch_ai_medication_info(drug_name, scientific_name, search_name, language)
+    if response.get("success"):
+        ai_medication_info_cache[cache_key] = response
+    return response
+
+
 @api_router.get("/ai/drug-info")
 async def get_ai_medication_info(
     drug_name: Optional[str] = None,
@@ -2596,177 +3390,28 @@ async def get_ai_medication_info(
         # Use drug_name or scientific_name (or both)
         search_name = drug_name or scientific_name
         
-        # Fetch information from AI (using async method)
-        result = await ai_drug_info.get_drug_info_async(
-            drug_name=search_name,
-            scientific_name=scientific_name if scientific_name != drug_name else None,
-            language=language
-        )
-        
-        if not result.get("success"):
-            return {
-                "success": False,
-                "message": "Could not get information from AI",
-                "error": result.get("error", "Unknown error")
-            }
-        
-        # Try to match with SFDA database for package size and accurate info
-        sfda_match = None
-        treatment_duration_days = None
-        
-        try:
-            # Search in SFDA database
-            query = {
-                "$or": [
-                    {"trade_name_lower": {"$regex": search_name.lower(), "$options": "i"}},
-                    {"scientific_name": {"$regex": search_name, "$options": "i"}}
-                ]
-            }
-            sfda_match = await db.sfda_medications.find_one(query, {"_id": 0})
-            
-            # Extract package size from drug name if not in SFDA or SFDA has wrong size
-            package_size_from_name = None
-            size_match = re.search(r'(\d+\.?\d*)\s*(g|gm|gram|ml|mg|ملغ|مجم|جم)', drug_name, re.IGNORECASE)
-            if size_match:
-                size_value = float(size_match.group(1))
-                size_unit = size_match.group(2).lower()
-                # Normalize units to grams or ml
-                if size_unit in ['g', 'gm', 'gram', 'جم']:
-                    package_size_from_name = size_value
-                elif size_unit in ['ml']:
-                    package_size_from_name = size_value
-                elif size_unit in ['mg', 'ملغ', 'مجم']:
-                    package_size_from_name = size_value / 1000  # Convert mg to g
-            
-            if sfda_match or package_size_from_name:
-                # Calculate treatment duration based on dosage and package size
-                dosage_text = result.get("dosage", "")
-                
-                # Use package size from name if available and SFDA is unreliable (< 2)
-                package_size = package_size_from_name if package_size_from_name and (not sfda_match or sfda_match.get("package_size", 0) < 2) else sfda_match.get("package_size", 0) if sfda_match else 0
-                
-                if package_size and dosage_text:
-                    # Parse dosage to extract times per day
-                    import re
-                    times_per_day = 1  # Default
-                    
-                    # Arabic patterns
-                    if "مرتين" in dosage_text or "twice" in dosage_text.lower():
-                        times_per_day = 2
-                    elif "ثلاث مرات" in dosage_text or "three times" in dosage_text.lower():
-                        times_per_day = 3
-                    elif "أربع مرات" in dosage_text or "four times" in dosage_text.lower():
-                        times_per_day = 4
-                    elif "مرة واحدة" in dosage_text or "once" in dosage_text.lower():
-                        times_per_day = 1
-                    
-                    # Check for "every X hours" pattern
-                    hours_match = re.search(r'كل\s*(\d+)(?:-\d+)?\s*ساعات?', dosage_text)
-                    if hours_match:
-                        hours = int(hours_match.group(1))
-                        times_per_day = 24 // hours
-                    
-                    # Check for text numbers (five times, four days, etc.)
-                    text_numbers = {
-                        'five': 5, 'four': 4, 'three': 3, 'two': 2, 'one': 1,
-                        'six': 6, 'seven': 7, 'eight': 8
-                    }
-                    times_text_match = re.search(r'(five|four|three|two|one|six|seven|eight)\s+times', dosage_text, re.IGNORECASE)
-                    if times_text_match:
-                        times_per_day = text_numbers.get(times_text_match.group(1).lower(), times_per_day)
-                    
-                    # Extract treatment duration in days
-                    duration_days = None
-                    duration_text_match = re.search(r'(?:for|لمدة)\s+(one|two|three|four|five|six|seven|eight|nine|ten|\d+)\s+(day|days|يوم|أيام)', dosage_text, re.IGNORECASE)
-                    if duration_text_match:
-                        duration_num = duration_text_match.group(1).lower()
-                        if duration_num.isdigit():
-                            duration_days = int(duration_num)
-                        else:
-                            duration_days = text_numbers.get(duration_num, 1)
-                    
-                    # Calculate pills per time (default 1 unless specified)
-                    pills_per_time = 1
-                    pills_match = re.search(r'حبتين|حبتان|two tablets?', dosage_text, re.IGNORECASE)
-                    if pills_match:
-                        pills_per_time = 2
-                    
-                    # For topical medications (creams, ointments), assume 1g per application
-                    dosage_form = (sfda_match.get('dosage_form', '') if sfda_match else '') or drug_name
-                    is_topical = 'cream' in dosage_form.lower() or 'ointment' in dosage_form.lower() or 'gel' in dosage_form.lower() or 'كريم' in dosage_form.lower() or 'مرهم' in dosage_form.lower()
-                    
-                    logging.info(f"Checking topical: is_topical={is_topical}, package_size_from_name={package_size_from_name}, duration_days={duration_days}, dosage_form={dosage_form}")
-                    
-                    if is_topical and package_size_from_name and duration_days:
-                        # For topical: calculate based on grams/ml
-                        # Assume 1g or 1ml per application
-                        grams_per_application = 1.0
-                        total_applications = times_per_day * duration_days
-                        total_grams_needed = total_applications * grams_per_application
-                        
-                        # Calculate number of packages needed
-                        packages_needed = int(total_grams_needed / package_size_from_name) + (1 if total_grams_needed % package_size_from_name > 0 else 0)
-                        
-                        # Treatment duration = total days
-                        treatment_duration_days = duration_days
-                        
-                        logging.info(f"Topical medication {search_name}: {packages_needed} package(s) needed for {duration_days} days (package: {package_size_from_name}g, {times_per_day}x daily)")
-                    else:
-                        # For tablets/capsules: regular calculation
-                        daily_usage = times_per_day * pills_per_time
-                        
-                        # Calculate treatment duration
-                        if daily_usage > 0:
-                            treatment_duration_days = int(package_size / daily_usage)
-                            
-                            logging.info(f"Calculated treatment duration for {search_name}: {treatment_duration_days} days (package: {package_size}, daily: {daily_usage})")
-        
-        except Exception as e:
-            logging.error(f"Error matching with SFDA database: {str(e)}")
-        
-        response_data = {
-            "classification": result.get("classification", ""),
-            "uses": result.get("uses", ""),
-            "dosage": result.get("dosage", ""),
-            "warnings": result.get("warnings", ""),
-            "pregnancy_lactation": result.get("pregnancy_lactation", ""),
-            "source": "AI (OpenAI GPT-4)",
-            "search_term": result.get("search_term", "")
-        }
+        # Cached responses (same drug and language) skip the AI call and SFDA matching entirely
+        cache_key = (search_name.lower().strip(), (scientific_name or "").lower().strip(), language)
+        cached = ai_medication_info_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"AI drug info cache hit: {cache_key}")
+            return ORJSONResponse({**cached, "cached": True})
+        
+        # Concurrent requests for the same drug share one in-flight fetch instead of each calling the AI
+        task = ai_medication_info_inflight.get(cache_key)
+        if task is None:
+            logging.info(f"AI drug info cache miss: {cache_key}")
+            task = asyncio.create_task(
+                fetch_and_cache_ai_medication_info(cache_key, drug_name, scientific_name, search_name, language)
+            )
+            ai_medication_info_inflight[cache_key] = task
+            task.add_done_callback(lambda _: ai_medication_info_inflight.pop(cache_key, None))
         
-        # Add SFDA info if matched
-        if sfda_match:
-            legal_status = sfda_match.get("legal_status", "").lower()
-            is_prescription = "prescription" in legal_status
-            
-            response_data["sfda_match"] = {
-                "trade_name": sfda_match.get("trade_name", ""),
-                "trade_name_ar": sfda_match.get("trade_name_ar", ""),
-                "package_size": sfda_match.get("package_size", 0),
-                "strength": sfda_match.get("strength", ""),
-                "strength_unit": sfda_match.get("strength_unit", ""),
-                "dosage_form": sfda_match.get("dosage_form", ""),
-                "dosage_form_ar": sfda_match.get("dosage_form_ar", ""),
-                "price_sar": sfda_match.get("price_sar", 0),
-                "legal_status": sfda_match.get("legal_status", ""),
-                "legal_status_ar": sfda_match.get("legal_status_ar", ""),
-                "is_prescription": is_prescription
-            }
-            
-            if treatment_duration_days:
-                response_data["sfda_match"]["calculated_treatment_duration_days"] = treatment_duration_days
-            
-            # Add prescription warning if applicable
-            if is_prescription:
-                response_data["prescription_warning"] = {
-                    "ar": "⚠️ هذا الدواء يحتاج وصفة طبية. الجرعات تختلف باختلاف الحالة الطبية ودائماً يجب الرجوع للطبيب المعالج.",
-                    "en": "⚠️ This medication requires a prescription. Dosages vary depending on the medical condition and you should always consult your treating physician."
-                }
+        # Shielded so one disconnected client doesn't cancel the fetch the others are waiting on
+        response = await asyncio.shield(task)
         
-        return {
-            "success": True,
-            "data": response_data
-        }
+        # Plain JSON-native dict: serialize directly, skipping FastAPI's jsonable_encoder pass
+        return ORJSONResponse(response)
         
     except HTTPException:
         raise
@@ -2807,6 +3452,7 @@ async def update_user_subscription(
                 }
             }
         )
+        invalidate_cached_user(user_id)
         
         return {"success": True, "message": "Subscription updated"}
     except Exception as e:
@@ -2824,83 +3470,181 @@ async def disable_user_account(
             {"id": user_id},
             {"$set": {"account_disabled": True, "disabled_at": datetime.now(timezone.utc).isoformat()}}
         )
+        invalidate_cached_user(user_id)
         return {"success": True, "message": "User disabled"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def count_users_by_day(since: datetime) -> dict:
+    """Users registered per UTC day (YYYY-MM-DD -> count) from since on, in one aggregation"""
+    pipeline = [
+        {"$match": {"created_at": {"$gte": since}}},
+        {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}, "count": {"$sum": 1}}}
+    ]
+    return {row["_id"]: row["count"] async for row in db.users.aggregate(pipeline)}
+
+# Admin dashboard payloads are reused for a minute instead of recounting on every load
+admin_dashboard_cache = TTLCache(maxsize=8, ttl=60)
+
+async def compute_admin_analytics() -> dict:
+    """User totals, gender distribution and 30-day growth for the admin dashboard"""
+    # Total registered, active (logged in last 7 days) and deleted accounts, counted concurrently
+    # (unfiltered totals come from collection metadata; may be slightly stale, fine for a dashboard)
+    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+    total_users, active_users, deleted_users = await asyncio.gather(
+        db.users.estimated_document_count(),
+        db.users.count_documents({"last_login": {"$gte": seven_days_ago.isoformat()}}),
+        db.users.count_documents({"account_deleted": True})
+    )
+    
+    # Gender distribution (if available), one pass over users
+    gender_counts = {
+        row["_id"]: row["count"]
+        async for row in db.users.aggregate([{"$group": {"_id": "$gender", "count": {"$sum": 1}}}])
+    }
+    gender_stats = {
+        "male": gender_counts.get("male", 0),
+        "female": gender_counts.get("female", 0),
+        "other": gender_counts.get("other", 0),
+        "not_specified": gender_counts.get(None, 0)
+    }
+    
+    # Age distribution (if available)
+    # This would need birth_date field
+    
+    # User growth over time (last 30 days): users before the window plus a running daily sum
+    today = datetime.now(timezone.utc).date()
+    start_day = datetime.combine(today - timedelta(days=30), datetime.min.time(), tzinfo=timezone.utc)
+    daily_counts, running_total = await asyncio.gather(
+        count_users_by_day(start_day),
+        db.users.count_documents({"created_at": {"$lt": start_day}})
+    )
+    user_growth = []
+    for i in range(30, -1, -1):
+        date_str = (today - timedelta(days=i)).isoformat()
+        running_total += daily_counts.get(date_str, 0)
+        user_growth.append({"date": date_str, "count": running_total})
+    
+    return {
+        "total_users": total_users,
+        "active_users": active_users,
+        "deleted_users": deleted_users,
+        "gender_stats": gender_stats,
+        "user_growth": user_growth
+    }
+
+async def compute_top_medications() -> list:
+    """Top 100 most added medications with their unique user counts"""
+    # Aggregate medications by name: (name, user) pairs first, then per name, so unique
+    # users are counted without holding every user id of a medication in one array
+    pipeline = [
+        {"$group": {
+            "_id": {"name": "$medication_name", "user_id": "$user_id"},
+            "adds": {"$sum": 1}
+        }},
+        {"$group": {
+            "_id": "$_id.name",
+            "count": {"$sum": "$adds"},
+            "unique_users": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "name": "$_id",
+            "count": 1,
+            "unique_users": 1
+        }},
+        {"$sort": {"count": -1}},
+        {"$limit": 100}
+    ]
+    return await db.user_medications.aggregate(pipeline, allowDiskUse=True).to_list(length=100)
+
+# The heavy dashboard aggregations are materialized into db.cached_analytics by a background
+# job, so the analytics and top-medications endpoints only read one document
+ADMIN_DASHBOARD_REFRESH_INTERVAL_SECONDS = 300
+admin_dashboard_refresher_task = None
+
+async def refresh_admin_dashboard() -> dict:
+    """Recompute the materialized admin dashboard and store it"""
+    analytics, top_medications = await asyncio.gather(compute_admin_analytics(), compute_top_medications())
+    dashboard = {
+        "analytics": analytics,
+        "top_medications": top_medications,
+        "generated_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.cached_analytics.replace_one({"_id": "admin_dashboard"}, dashboard, upsert=True)
+    return dashboard
+
+async def get_admin_dashboard() -> dict:
+    """Materialized admin dashboard, computed on the spot if the job has not stored one yet"""
+    dashboard = await db.cached_analytics.find_one({"_id": "admin_dashboard"}, {"_id": 0})
+    return dashboard or await refresh_admin_dashboard()
+
+async def admin_dashboard_refresher():
+    """Periodically refresh the materialized admin dashboard"""
+    while True:
+        try:
+            await refresh_admin_dashboard()
+        except Exception as e:
+            logger.error(f"Error refreshing admin dashboard: {e}")
+        await asyncio.sleep(ADMIN_DASHBOARD_REFRESH_INTERVAL_SECONDS)
+
 @api_router.get("/admin/analytics")
-async def get_admin_analytics(admin_user: dict = Depends(get_admin_user)):
-    """Get advanced analytics"""
+async def get_admin_analytics(
+    days: int = 30,
+    admin_user: dict = Depends(get_admin_user)
+):
+    """Get advanced analytics, plus top medications and activity for the last `days` days"""
     try:
-        # Total registered
-        total_users = await db.users.count_documents({})
-        
-        # Active users (logged in last 7 days)
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-        active_users = await db.users.count_documents({
-            "last_login": {"$gte": seven_days_ago.isoformat()}
-        })
-        
-        # Deleted accounts
-        deleted_users = await db.users.count_documents({"account_deleted": True})
-        
-        # Gender distribution (if available)
-        gender_stats = {
-            "male": await db.users.count_documents({"gender": "male"}),
-            "female": await db.users.count_documents({"gender": "female"}),
-            "other": await db.users.count_documents({"gender": "other"}),
-            "not_specified": await db.users.count_documents({"gender": {"$exists": False}})
-        }
+        start_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
         
-        # Age distribution (if available)
-        # This would need birth_date field
+        # Most added medications (active, by brand)
+        pipeline = [
+            {"$match": {"active": True}},
+            {"$group": {
+                "_id": "$brand_name",
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"count": -1}},
+            {"$limit": 10}
+        ]
         
-        # User growth over time (last 30 days)
-        user_growth = []
-        for i in range(30, -1, -1):
-            date = datetime.now(timezone.utc) - timedelta(days=i)
-            date_str = date.strftime('%Y-%m-%d')
-            count = await db.users.count_documents({
-                "created_at": {"$lte": date.isoformat()}
-            })
-            user_growth.append({"date": date_str, "count": count})
+        dashboard, top_meds, total_meds_added, total_reminders_created = await asyncio.gather(
+            get_admin_dashboard(),
+            db.user_medications.aggregate(pipeline).to_list(length=10),
+            db.user_medications.count_documents({"created_at": {"$gte": start_date}}),
+            db.medication_reminders.count_documents({"created_at": {"$gte": start_date}})
+        )
         
         return {
-            "total_users": total_users,
-            "active_users": active_users,
-            "deleted_users": deleted_users,
-            "gender_stats": gender_stats,
-            "user_growth": user_growth
+            **dashboard["analytics"],
+            "top_medications": top_meds,
+            "activity": {
+                "medications_added": total_meds_added,
+                "reminders_created": total_reminders_created
+            },
+            "generated_at": dashboard["generated_at"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@api_router.post("/admin/analytics/refresh")
+async def refresh_admin_analytics(admin_user: dict = Depends(get_admin_user)):
+    """Recompute the admin analytics and top medications now"""
+    try:
+        dashboard = await refresh_admin_dashboard()
+        return {"success": True, "generated_at": dashboard["generated_at"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @api_router.get("/admin/top-medications")
 async def get_top_medications(admin_user: dict = Depends(get_admin_user)):
     """Get top 100 most added medications"""
     try:
-        # Aggregate medications by name
-        pipeline = [
-            {"$group": {
-                "_id": "$medication_name",
-                "count": {"$sum": 1},
-                "users": {"$addToSet": "$user_id"}
-            }},
-            {"$project": {
-                "_id": 0,
-                "name": "$_id",
-                "count": 1,
-                "unique_users": {"$size": "$users"}
-            }},
-            {"$sort": {"count": -1}},
-            {"$limit": 100}
-        ]
-        
-        top_meds = await db.user_medications.aggregate(pipeline).to_list(length=100)
-        
-        return {"medications": top_meds}
+        dashboard = await get_admin_dashboard()
+        return {"medications": dashboard["top_medications"], "generated_at": dashboard["generated_at"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2954,6 +3698,60 @@ async def reply_to_message(
 
 
 
+NOTIFICATION_INSERT_BATCH_SIZE = 1000
+# Admin broadcast rows only need the primary's ack (w=1), not replication to a majority; the push
+# is the delivery channel and the row is the in-app copy. Failures are still reported.
+bulk_notifications = db.notifications.with_options(write_concern=WriteConcern(w=1))
+
+async def insert_notification_batch(notifications: list) -> int:
+    """Insert one unordered batch; rows that fail are logged instead of failing the whole send"""
+    try:
+        result = await bulk_notifications.insert_many(notifications, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        logger.warning(f"{len(write_errors)} of {len(notifications)} notifications failed to insert: {write_errors[:3]}")
+        return e.details.get("nInserted", 0)
+
+def build_user_notifications(user_ids: list, title: str, body: str, notification_type: str, now_iso: str) -> list:
+    """Notification documents for a batch of users, with ids drawn from one urandom read"""
+    # One os.urandom call per batch instead of one per uuid4(); version=4 sets the same bits uuid4 does
+    raw = os.urandom(16 * len(user_ids))
+    return [
+        {
+            "id": str(uuid.UUID(bytes=raw[i * 16:(i + 1) * 16], version=4)),
+            "user_id": user_id,
+            "title": title,
+            "body": body,
+            "type": notification_type,
+            "read": False,
+            "created_at": now_iso
+        }
+        for i, user_id in enumerate(user_ids)
+    ]
+
+async def insert_notifications_for_users(query: dict, title: str, body: str, notification_type: str) -> int:
+    """Create one in-app notification per matching user; returns how many were written"""
+    # Stream matching users and create their notifications in fixed-size unordered batches,
+    # so memory stays flat and no insert approaches the BSON size limit
+    sent_count = 0
+    user_ids = []
+    now_iso = datetime.now(timezone.utc).isoformat()  # one timestamp for the whole send
+    async for user in db.users.find(query, {"id": 1, "_id": 0}).batch_size(NOTIFICATION_INSERT_BATCH_SIZE):
+        user_ids.append(user["id"])
+        if len(user_ids) >= NOTIFICATION_INSERT_BATCH_SIZE:
+            sent_count += await insert_notification_batch(
+                build_user_notifications(user_ids, title, body, notification_type, now_iso)
+            )
+            user_ids = []
+    
+    if user_ids:
+        sent_count += await insert_notification_batch(
+            build_user_notifications(user_ids, title, body, notification_type, now_iso)
+        )
+    
+    return sent_count
+
 @api_router.post("/admin/send-notification-bulk")
 async def send_notification_bulk(
     notification_data: dict,
@@ -2973,36 +3771,18 @@ async def send_notification_bulk(
         if category == "new":
             # Users registered in last 7 days
             seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-            query["created_at"] = {"$gte": seven_days_ago.isoformat()}
+            query["created_at"] = {"$gte": seven_days_ago}
         elif category == "premium":
             query["is_premium"] = True
         elif category == "trial":
             query["subscription_tier"] = "trial"
         
-        # Get matching users
-        users = await db.users.find(query, {"id": 1, "_id": 0}).to_list(length=None)
-        
-        # Create notifications
-        notifications = []
-        for user in users:
-            notification = {
-                "id": str(uuid.uuid4()),
-                "user_id": user["id"],
-                "title": title,
-                "body": body,
-                "type": "admin",
-                "read": False,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            notifications.append(notification)
-        
-        if notifications:
-            await db.notifications.insert_many(notifications)
+        sent_count = await insert_notifications_for_users(query, title, body, "admin")
         
         return {
             "success": True,
-            "message": f"Sent to {len(notifications)} users",
-            "count": len(notifications)
+            "message": f"Sent to {sent_count} users",
+            "count": sent_count
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3012,30 +3792,34 @@ async def send_notification_bulk(
 async def get_admin_stats(admin_user: dict = Depends(get_admin_user)):
     """Get dashboard statistics for admin"""
     try:
-        # Total users
-        total_users = await db.users.count_documents({})
-        active_users = await db.users.count_documents({"is_premium": False})
-        premium_users = await db.users.count_documents({"is_premium": True})
-        
-        # Total medications added
-        total_medications = await db.user_medications.count_documents({})
-        active_medications = await db.user_medications.count_documents({"active": True})
-        
-        # SFDA Database stats
-        total_sfda_meds = await db.sfda_medications.count_documents({})
-        
-        # Recent users (last 7 days)
-        seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).isoformat()
-        recent_users = await db.users.count_documents({
-            "created_at": {"$gte": seven_days_ago}
-        })
+        cached = admin_dashboard_cache.get("stats")
+        if cached is not None:
+            return cached
         
-        # Recent medications (last 7 days)
-        recent_medications = await db.user_medications.count_documents({
-            "created_at": {"$gte": seven_days_ago}
-        })
+        # All counts are independent, so they run concurrently; unfiltered totals come from
+        # collection metadata (may be slightly stale, fine for a dashboard)
+        seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
+        (
+            total_users, active_users, premium_users,
+            total_medications, active_medications,
+            total_sfda_meds,
+            recent_users, recent_medications
+        ) = await asyncio.gather(
+            # Users
+            db.users.estimated_document_count(),
+            db.users.count_documents({"is_premium": False}),
+            db.users.count_documents({"is_premium": True}),
+            # Medications added
+            db.user_medications.estimated_document_count(),
+            db.user_medications.count_documents({"active": True}),
+            # SFDA Database stats
+            db.sfda_medications.estimated_document_count(),
+            # Recent users and medications (last 7 days)
+            db.users.count_documents({"created_at": {"$gte": seven_days_ago}}),
+            db.user_medications.count_documents({"created_at": {"$gte": seven_days_ago.isoformat()}})
+        )
         
-        return {
+        stats = {
             "success": True,
             "stats": {
                 "users": {
@@ -3054,6 +3838,8 @@ async def get_admin_stats(admin_user: dict = Depends(get_admin_user)):
                 }
             }
         }
+        admin_dashboard_cache["stats"] = stats
+        return stats
     except Exception as e:
         logging.error(f"Error getting admin stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3071,11 +3857,12 @@ async def get_all_users(
     try:
         query = {}
         
-        # Search filter
+        # Search filter: escaped, anchored prefix so each clause is answered from its index keys
         if search:
+            prefix = f"^{re.escape(search.strip())}"
             query["$or"] = [
-                {"email": {"$regex": search, "$options": "i"}},
-                {"full_name": {"$regex": search, "$options": "i"}}
+                {"email": {"$regex": prefix, "$options": "i"}},
+                {"full_name": {"$regex": prefix, "$options": "i"}}
             ]
         
         # Type filter
@@ -3086,22 +3873,25 @@ async def get_all_users(
         elif filter_type == "admin":
             query["is_admin"] = True
         
-        # Get users
-        users = await db.users.find(
-            query,
-            {"password_hash": 0, "_id": 0}
-        ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit)
-        
-        # Get total count
-        total = await db.users.count_documents(query)
+        # Get users and the total count concurrently
+        users, total = await asyncio.gather(
+            db.users.find(
+                query,
+                {"password_hash": 0, "_id": 0}
+            ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.users.count_documents(query)
+        )
         
-        # Get medication count for each user
+        # Get medication count for every user on the page in one aggregation
+        med_counts = {
+            row["_id"]: row["count"]
+            async for row in db.user_medications.aggregate([
+                {"$match": {"user_id": {"$in": [user["id"] for user in users]}, "active": True}},
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+            ])
+        }
         for user in users:
-            med_count = await db.user_medications.count_documents({
-                "user_id": user["id"],
-                "active": True
-            })
-            user["medication_count"] = med_count
+            user["medication_count"] = med_counts.get(user["id"], 0)
         
         return {
             "success": True,
@@ -3122,29 +3912,16 @@ async def get_user_details(
 ):
     """Get detailed information about a specific user"""
     try:
-        # Get user
-        user = await db.users.find_one({"id": user_id}, {"password_hash": 0, "_id": 0})
+        # User, medications, health data and reminders are fetched concurrently
+        user, medications, health_data, reminders = await asyncio.gather(
+            db.users.find_one({"id": user_id}, {"password_hash": 0, "_id": 0}),
+            db.user_medications.find({"user_id": user_id}, {"_id": 0}).to_list(length=None),
+            db.profile_health.find_one({"user_id": user_id}, {"_id": 0}),
+            db.medication_reminders.find({"user_id": user_id}, {"_id": 0}).to_list(length=None)
+        )
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Get user medications
-        medications = await db.user_medications.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).to_list(length=None)
-        
-        # Get health data
-        health_data = await db.profile_health.find_one(
-            {"user_id": user_id},
-            {"_id": 0}
-        )
-        
-        # Get reminders
-        reminders = await db.medication_reminders.find(
-            {"user_id": user_id},
-            {"_id": 0}
-        ).to_list(length=None)
-        
         return {
             "success": True,
             "user": user,
@@ -3191,6 +3968,7 @@ async def update_user_admin(
             {"id": user_id},
             {"$set": updates}
         )
+        invalidate_cached_user(user_id)
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
@@ -3230,109 +4008,40 @@ async def delete_user_admin(
         
         # Allow deleting other admins (removed restriction)
         
-        # Delete all user data
-        # 1. Delete user medications
-        meds_result = await db.user_medications.delete_many({"user_id": user_id})
-        
-        # 2. Delete medication reminders
-        reminders_result = await db.medication_reminders.delete_many({"user_id": user_id})
-        
-        # 3. Delete FCM tokens
-        fcm_result = await db.fcm_tokens.delete_many({"user_id": user_id})
-        
-        # 4. Delete notifications
-        notif_result = await db.notifications.delete_many({"user_id": user_id})
-        
-        # 5. Delete user account
-        user_result = await db.users.delete_one({"id": user_id})
-        
-        admin_identifier = admin_user.get('email') or admin_user.get('phone') or 'unknown'
-        logging.info(f"Admin {admin_identifier} deleted user {user_id} - Deleted: {meds_result.deleted_count} medications, {reminders_result.deleted_count} reminders, {fcm_result.deleted_count} FCM tokens, {notif_result.deleted_count} notifications")
-        
-        return {
-            "success": True,
-            "message": "User account deleted successfully",
-            "deleted": {
-                "user": user_result.deleted_count,
-                "medications": meds_result.deleted_count,
-                "reminders": reminders_result.deleted_count,
-                "fcm_tokens": fcm_result.deleted_count,
-                "notifications": notif_result.deleted_count
-            }
-        }
-    except HTTPException:
-        raise
-    except Exception as e:
-        logging.error(f"Error deleting user: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@api_router.get("/admin/analytics")
-async def get_analytics(
-    days: int = 30,
-    admin_user: dict = Depends(get_admin_user)
-):
-    """Get analytics and reports"""
-    try:
-        # Date range
-        start_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-        
-        # User growth
-        users_by_day = []
-        for i in range(days):
-            day_start = (datetime.now(timezone.utc) - timedelta(days=days-i)).isoformat()
-            day_end = (datetime.now(timezone.utc) - timedelta(days=days-i-1)).isoformat()
-            count = await db.users.count_documents({
-                "created_at": {"$gte": day_start, "$lt": day_end}
-            })
-            users_by_day.append({
-                "date": day_start.split("T")[0],
-                "count": count
-            })
-        
-        # Most added medications
-        pipeline = [
-            {"$match": {"active": True}},
-            {"$group": {
-                "_id": "$brand_name",
-                "count": {"$sum": 1}
-            }},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        top_meds = await db.user_medications.aggregate(pipeline).to_list(length=10)
-        
-        # Most searched SFDA medications (from recent user medications)
-        recent_meds = await db.user_medications.find(
-            {"created_at": {"$gte": start_date}},
-            {"brand_name": 1, "_id": 0}
-        ).limit(100).to_list(length=100)
-        
-        # Activity stats
-        total_meds_added = await db.user_medications.count_documents({
-            "created_at": {"$gte": start_date}
-        })
+        # Delete all user data (medications, reminders, FCM tokens, notifications and the account);
+        # the collections are independent, so the deletes run concurrently
+        meds_result, reminders_result, fcm_result, notif_result, user_result = await asyncio.gather(
+            db.user_medications.delete_many({"user_id": user_id}),
+            db.medication_reminders.delete_many({"user_id": user_id}),
+            db.fcm_tokens.delete_many({"user_id": user_id}),
+            db.notifications.delete_many({"user_id": user_id}),
+            db.users.delete_one({"id": user_id})
+        )
+        invalidate_cached_user(user_id)
         
-        total_reminders_created = await db.medication_reminders.count_documents({
-            "created_at": {"$gte": start_date}
-        })
+        admin_identifier = admin_user.get('email') or admin_user.get('phone') or 'unknown'
+        logging.info(f"Admin {admin_identifier} deleted user {user_id} - Deleted: {meds_result.deleted_count} medications, {reminders_result.deleted_count} reminders, {fcm_result.deleted_count} FCM tokens, {notif_result.deleted_count} notifications")
         
         return {
             "success": True,
-            "analytics": {
-                "user_growth": users_by_day,
-                "top_medications": top_meds,
-                "activity": {
-                    "medications_added": total_meds_added,
-                    "reminders_created": total_reminders_created
-                }
+            "message": "User account deleted successfully",
+            "deleted": {
+                "user": user_result.deleted_count,
+                "medications": meds_result.deleted_count,
+                "reminders": reminders_result.deleted_count,
+                "fcm_tokens": fcm_result.deleted_count,
+                "notifications": notif_result.deleted_count
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error getting analytics: {str(e)}")
+        logging.error(f"Error deleting user: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+SFDA_UPLOAD_INSERT_BATCH_SIZE = 5000
+
 @api_router.post("/admin/sfda/upload")
 async def upload_sfda_file(
     file: UploadFile = File(...),
@@ -3340,41 +4049,53 @@ async def upload_sfda_file(
 ):
     """Upload new SFDA Excel file and update database"""
     try:
-        # Save uploaded file
+        # Save uploaded file in 1 MB chunks instead of buffering the whole upload
         file_path = f"/tmp/sfda_upload_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(1 << 20):
+                f.write(chunk)
         
-        # Process Excel file
+        # Process Excel file (parsing is CPU-bound, keep it off the event loop)
         import pandas as pd
-        df = pd.read_excel(file_path)
-        
-        medications = []
-        for idx, row in df.iterrows():
-            med = {
-                "manufacturer": str(row['Manufacturer']).strip() if pd.notna(row['Manufacturer']) else "",
-                "trade_name": str(row['Trade Name']).strip() if pd.notna(row['Trade Name']) else "",
-                "trade_name_lower": str(row['Trade Name']).strip().lower() if pd.notna(row['Trade Name']) else "",
-                "strength": str(row['Strength']).strip() if pd.notna(row['Strength']) else "",
-                "pack": str(row['Pack']).strip() if pd.notna(row['Pack']) else "",
-                "active_ingredients": str(row['Active Ingrediants']).strip() if pd.notna(row['Active Ingrediants']) else "",
-                "active_ingredients_lower": str(row['Active Ingrediants']).strip().lower() if pd.notna(row['Active Ingrediants']) else "",
-                "price_sar": float(row['MOH Price']) if pd.notna(row['MOH Price']) else None,
-                "source": "SFDA",
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-            medications.append(med)
-        
-        # Drop old collection and insert new
-        await db.sfda_medications.drop()
-        if medications:
-            await db.sfda_medications.insert_many(medications)
+        df = await asyncio.to_thread(pd.read_excel, file_path)
+        
+        # Build the documents column-wise (blank cells become "", a missing price becomes None)
+        def text_column(name):
+            return df[name].fillna("").astype(str).str.strip()
+        
+        trade_names = text_column('Trade Name')
+        active_ingredients = text_column('Active Ingrediants')
+        medications_df = pd.DataFrame({
+            "manufacturer": text_column('Manufacturer'),
+            "trade_name": trade_names,
+            "trade_name_lower": trade_names.str.lower(),
+            "strength": text_column('Strength'),
+            "pack": text_column('Pack'),
+            "active_ingredients": active_ingredients,
+            "active_ingredients_lower": active_ingredients.str.lower(),
+            "price_sar": df['MOH Price'].astype(float).astype(object).where(df['MOH Price'].notna(), None),
+            "source": "SFDA",
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        })
+        medications_df["search_tokens"] = [
+            [token for token in {trade_lower, ingredients_lower} if token]
+            for trade_lower, ingredients_lower in zip(medications_df["trade_name_lower"], medications_df["active_ingredients_lower"])
+        ]
+        medications = medications_df.to_dict(orient="records")
         
-        # Recreate indexes
-        await db.sfda_medications.create_index("trade_name_lower")
-        await db.sfda_medications.create_index("active_ingredients_lower")
-        await db.sfda_medications.create_index("manufacturer")
+        # Load a staging collection in unordered batches, give it the same derived fields and
+        # indexes as sfda_medications, then swap it in with one rename so readers never see an
+        # empty or half-indexed sfda_medications; on failure the old collection is left untouched
+        staging = db[f"sfda_medications_staging_{uuid.uuid4().hex}"]
+        try:
+            for start in range(0, len(medications), SFDA_UPLOAD_INSERT_BATCH_SIZE):
+                await staging.insert_many(medications[start:start + SFDA_UPLOAD_INSERT_BATCH_SIZE], ordered=False)
+            await ensure_sfda_medication_indexes(staging)
+            await staging.rename("sfda_medications", dropTarget=True)
+        except Exception:
+            await staging.drop()
+            raise
+        medication_details_cache.clear()
         
         # Clean up
         import os
@@ -3394,8 +4115,6 @@ async def upload_sfda_file(
 async def get_sfda_stats(admin_user: dict = Depends(get_admin_user)):
     """Get SFDA database statistics"""
     try:
-        total = await db.sfda_medications.count_documents({})
-        
         # Count by manufacturer
         pipeline = [
             {"$group": {
@@ -3405,7 +4124,6 @@ async def get_sfda_stats(admin_user: dict = Depends(get_admin_user)):
             {"$sort": {"count": -1}},
             {"$limit": 10}
         ]
-        top_manufacturers = await db.sfda_medications.aggregate(pipeline).to_list(length=10)
         
         # Price statistics
         pipeline_price = [
@@ -3417,7 +4135,14 @@ async def get_sfda_stats(admin_user: dict = Depends(get_admin_user)):
                 "max_price": {"$max": "$price_sar"}
             }}
         ]
-        price_stats = await db.sfda_medications.aggregate(pipeline_price).to_list(length=1)
+        
+        # Total (collection metadata count; the SFDA table only changes on upload) and both
+        # aggregations are independent, so they run concurrently
+        total, top_manufacturers, price_stats = await asyncio.gather(
+            db.sfda_medications.estimated_document_count(),
+            db.sfda_medications.aggregate(pipeline).to_list(length=10),
+            db.sfda_medications.aggregate(pipeline_price).to_list(length=1)
+        )
         
         return {
             "success": True,
@@ -3499,12 +4224,14 @@ async def get_support_tickets(
         if category:
             query["category"] = category
         
-        tickets = await db.support_tickets.find(
-            query,
-            {"_id": 0}
-        ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit)
-        
-        total = await db.support_tickets.count_documents(query)
+        # Page and total count run concurrently
+        tickets, total = await asyncio.gather(
+            db.support_tickets.find(
+                query,
+                {"_id": 0}
+            ).sort("created_at", -1).skip(skip).limit(limit).to_list(length=limit),
+            db.support_tickets.count_documents(query)
+        )
         
         return {
             "success": True,
@@ -3563,6 +4290,7 @@ FREE_USER_LIMITS = {
     "max_reminders": 100,  # Increased for testing
     "reminder_expiry_days": 30  # Increased for testing
 }
+MAX_SFDA_SEARCHES: Final[int] = FREE_USER_LIMITS["max_sfda_searches"]
 
 async def check_medication_limit(user_id: str, is_premium: bool) -> bool:
     """Check if user can add more medications based on total attempts (not active count)"""
@@ -3577,51 +4305,256 @@ async def check_medication_limit(user_id: str, is_premium: bool) -> bool:
     medications_added = user.get("medications_added_count", 0)
     return medications_added < FREE_USER_LIMITS["max_medications"]
 
-async def check_sfda_search_limit(user_id: str, is_premium: bool, current_searches: int) -> bool:
-    """Check if user can perform more SFDA searches"""
+async def reserve_medication_slot(user_id: str, is_premium: bool) -> bool:
+    """Atomically check the medication limit and increment medications_added_count in one round-trip"""
     if is_premium:
         return True
     
-    return current_searches < FREE_USER_LIMITS["max_sfda_searches"]
+    # Compare-and-increment: only matches while the user is still under the limit
+    user = await db.users.find_one_and_update(
+        {
+            "id": user_id,
+            "$or": [
+                {"medications_added_count": {"$lt": FREE_USER_LIMITS["max_medications"]}},
+                {"medications_added_count": {"$exists": False}}
+            ]
+        },
+        {"$inc": {"medications_added_count": 1}},
+        projection={"_id": 1}
+    )
+    invalidate_cached_user(user_id)
+    return user is not None
 
-async def check_reminder_limit(user_id: str, is_premium: bool) -> bool:
-    """Check if user can add more reminders"""
+async def release_medication_slot(user_id: str, is_premium: bool):
+    """Undo reserve_medication_slot when the medication insert fails"""
+    if is_premium:
+        return
+    
+    await db.users.update_one(
+        {"id": user_id},
+        {"$inc": {"medications_added_count": -1}}
+    )
+    invalidate_cached_user(user_id)
+
+# Free-user SFDA search counts live in memory and are written to users.sfda_searches_used in
+# batches, so a search costs no database round trip for the limit (counts are per process)
+SFDA_SEARCH_FLUSH_INTERVAL_SECONDS = 20
+sfda_search_counts = TTLCache(maxsize=200000, ttl=86400)  # user_id -> searches used, including unflushed
+sfda_search_pending = defaultdict(int)  # user_id -> searches not yet written to the users collection
+sfda_search_flusher_task = None
+
+def reserve_sfda_search(user_id: str, current_searches: int):
+    """Check if a free user can perform more SFDA searches; returns (allowed, searches used before this one)"""
+    used = sfda_search_counts.get(user_id)
+    if used is None:
+        used = current_searches + sfda_search_pending.get(user_id, 0)
+    if used >= MAX_SFDA_SEARCHES:
+        sfda_search_counts[user_id] = used
+        return False, used
+    
+    sfda_search_counts[user_id] = used + 1
+    return True, used
+
+def settle_sfda_search(user_id: str, found: bool):
+    """Queue a reserved search for the next flush, or hand it back if it found nothing"""
+    if found:
+        sfda_search_pending[user_id] += 1
+    elif user_id in sfda_search_counts:
+        sfda_search_counts[user_id] -= 1
+
+async def flush_sfda_search_counts():
+    """Write queued SFDA search counts to the users collection"""
+    if not sfda_search_pending:
+        return
+    pending = dict(sfda_search_pending)
+    sfda_search_pending.clear()
+    try:
+        await db.users.bulk_write(
+            [UpdateOne({"id": user_id}, {"$inc": {"sfda_searches_used": count}}) for user_id, count in pending.items()],
+            ordered=False
+        )
+    except Exception as e:
+        logger.error(f"Error flushing SFDA search counts: {e}")
+        for user_id, count in pending.items():
+            sfda_search_pending[user_id] += count
+        return
+    for user_id in pending:
+        invalidate_cached_user(user_id)
+
+async def sfda_search_flusher():
+    """Periodically persist free-user SFDA search counts"""
+    while True:
+        await asyncio.sleep(SFDA_SEARCH_FLUSH_INTERVAL_SECONDS)
+        await flush_sfda_search_counts()
+
+# Reminders that count against the free limit; a missing flag is treated as enabled, as toggle_reminder does
+ENABLED_REMINDER_FILTER = {"enabled": {"$ne": False}}
+
+def is_reminder_enabled(reminder: dict) -> bool:
+    return reminder.get("enabled", True) is not False
+
+async def check_reminder_limit(user_id: str, is_premium: bool, current_count: Optional[int]) -> bool:
+    """Check if user can add more reminders (current_count is the user's active_reminder_count)"""
     if is_premium:
         return True
     
-    count = await db.medication_reminders.count_documents({"user_id": user_id, "enabled": True})
-    return count < FREE_USER_LIMITS["max_reminders"]
+    if current_count is None:
+        # Users not covered by the startup backfill (e.g. inserted without the field): count once and store it
+        current_count = await db.medication_reminders.count_documents({"user_id": user_id, **ENABLED_REMINDER_FILTER})
+        await db.users.update_one(
+            {"id": user_id, "active_reminder_count": {"$exists": False}},
+            {"$set": {"active_reminder_count": current_count}}
+        )
+        invalidate_cached_user(user_id)
+    return current_count < FREE_USER_LIMITS["max_reminders"]
+
+async def backfill_user_reminder_counts():
+    """Store active_reminder_count on users created before the field existed, so limit checks never count"""
+    legacy_user_ids = [user["id"] async for user in db.users.find({"active_reminder_count": {"$exists": False}}, {"_id": 0, "id": 1})]
+    if not legacy_user_ids:
+        return
+    counts = {
+        row["_id"]: row["count"]
+        async for row in db.medication_reminders.aggregate([
+            {"$match": {"user_id": {"$in": legacy_user_ids}, **ENABLED_REMINDER_FILTER}},
+            {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+        ])
+    }
+    await db.users.bulk_write([
+        UpdateOne(
+            {"id": user_id, "active_reminder_count": {"$exists": False}},
+            # reminder_count was an earlier all-reminders counter; this one supersedes it
+            {"$set": {"active_reminder_count": counts.get(user_id, 0)}, "$unset": {"reminder_count": ""}}
+        )
+        for user_id in legacy_user_ids
+    ], ordered=False)
+
+async def adjust_reminder_count(user_id: str, delta: int):
+    """Keep users.active_reminder_count in step as the user's enabled reminders change"""
+    if not delta:
+        return
+    # Only users whose counter has been initialized; others are counted on their next limit check
+    await db.users.update_one(
+        {"id": user_id, "active_reminder_count": {"$exists": True}},
+        {"$inc": {"active_reminder_count": delta}}
+    )
+    invalidate_cached_user(user_id)
+
+async def adjust_reminder_counts(deleted_user_ids: List[str]):
+    """Decrement active_reminder_count for a batch of deleted enabled reminders (one user id per reminder)"""
+    per_user = defaultdict(int)
+    for user_id in deleted_user_ids:
+        per_user[user_id] += 1
+    if not per_user:
+        return
+    await db.users.bulk_write([
+        UpdateOne({"id": user_id, "active_reminder_count": {"$exists": True}}, {"$inc": {"active_reminder_count": -count}})
+        for user_id, count in per_user.items()
+    ], ordered=False)
+    for user_id in per_user:
+        invalidate_cached_user(user_id)
+
+REMINDER_CLEANUP_USER_BATCH_SIZE = 10000
+
+async def delete_expired_reminders(user_ids: List[str], cutoff_date: str) -> int:
+    """Delete reminders created before cutoff_date for a batch of users; returns how many were deleted"""
+    expired_filter = {
+        "user_id": {"$in": user_ids},
+        "created_at": {"$lt": cutoff_date}
+    }
+    expired = await db.medication_reminders.find(expired_filter, {"_id": 1, "user_id": 1, "enabled": 1}).to_list(length=None)
+    if not expired:
+        return 0
+    result = await db.medication_reminders.delete_many({"_id": {"$in": [r["_id"] for r in expired]}})
+    await adjust_reminder_counts([r["user_id"] for r in expired if is_reminder_enabled(r)])
+    return result.deleted_count
 
 async def cleanup_expired_reminders():
     """Delete reminders for free users that are older than 3 days"""
     try:
         cutoff_date = (datetime.now(timezone.utc) - timedelta(days=FREE_USER_LIMITS["reminder_expiry_days"])).isoformat()
         
-        # Get all non-premium users
-        free_users = await db.users.find({"is_premium": False}, {"id": 1}).to_list(length=None)
-        free_user_ids = [user["id"] for user in free_users]
-        
-        # Delete old reminders for free users
-        result = await db.medication_reminders.delete_many({
-            "user_id": {"$in": free_user_ids},
-            "created_at": {"$lt": cutoff_date}
-        })
-        
-        if result.deleted_count > 0:
-            logger.info(f"Deleted {result.deleted_count} expired reminders for free users")
+        # Stream non-premium users and delete their old reminders one bounded batch of ids at a time
+        deleted_count = 0
+        free_user_ids = []
+        async for user in db.users.find({"is_premium": False}, {"_id": 0, "id": 1}).batch_size(REMINDER_CLEANUP_USER_BATCH_SIZE):
+            free_user_ids.append(user["id"])
+            if len(free_user_ids) >= REMINDER_CLEANUP_USER_BATCH_SIZE:
+                deleted_count += await delete_expired_reminders(free_user_ids, cutoff_date)
+                free_user_ids = []
+        if free_user_ids:
+            deleted_count += await delete_expired_reminders(free_user_ids, cutoff_date)
+        
+        if deleted_count > 0:
+            logger.info(f"Deleted {deleted_count} expired reminders for free users")
     except Exception as e:
         logger.error(f"Error cleaning up expired reminders: {e}")
 
 
+ORPHAN_REMINDER_SWEEP_INTERVAL_SECONDS = 3600
+orphan_reminder_reaper_task = None
+
+async def cleanup_orphan_reminders():
+    """Delete reminders whose medication no longer exists (all users, one sweep)"""
+    try:
+        orphans = await db.medication_reminders.aggregate([
+            {"$match": {"medication_id": {"$nin": [None, ""]}}},
+            {"$lookup": {
+                "from": "user_medications",
+                "let": {"user_id": "$user_id", "medication_id": "$medication_id"},
+                "pipeline": [
+                    {"$match": {
+                        "active": True,
+                        "$expr": {"$and": [
+                            {"$eq": ["$user_id", "$$user_id"]},
+                            REMINDER_MEDICATION_MATCH_EXPR
+                        ]}
+                    }},
+                    {"$limit": 1},
+                    {"$project": {"_id": 0, "id": 1}}
+                ],
+                "as": "_medication"
+            }},
+            {"$match": {"_medication": {"$size": 0}}},
+            {"$project": {"_id": 1, "user_id": 1, "enabled": 1}}
+        ]).to_list(length=None)
+        
+        if orphans:
+            # One delete for every user's orphans, keyed on _id so it is served by the primary index
+            result = await db.medication_reminders.delete_many({"_id": {"$in": [o["_id"] for o in orphans]}})
+            await adjust_reminder_counts([o["user_id"] for o in orphans if is_reminder_enabled(o)])
+            logger.info(f"🧹 Cleaned up {result.deleted_count} orphan reminders")
+    except Exception as e:
+        logger.error(f"Error cleaning up orphan reminders: {e}")
+
+async def orphan_reminder_reaper():
+    """Periodically sweep orphan reminders so read endpoints never have to delete"""
+    while True:
+        await cleanup_orphan_reminders()
+        await asyncio.sleep(ORPHAN_REMINDER_SWEEP_INTERVAL_SECONDS)
+
+
 # =============================================================================
 # TAP PAYMENTS & SUBSCRIPTIONS
 # ===========================
 
+# Shared Tap client so checkout and status calls reuse pooled keep-alive connections.
+# The pool is sized for checkout bursts plus payment-status polling so concurrent
+# users don't queue on PoolTimeout; Tap's own rate limits are the real ceiling.
+# HTTP/2 is negotiated via ALPN (falling back to HTTP/1.1), and since Tap is a single
+# origin a few multiplexed connections carry the load, so few are kept idle. They stay
+# open for 60s between bursts so checkouts rarely pay for a fresh TLS handshake.
+tap_http_client = httpx.AsyncClient(
+    timeout=30.0,
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=5, keepalive_expiry=60.0)
+)
+
 # Import Tap Payments client
 try:
     from tap_payments import TapPaymentsClient
     TAP_ENABLED = True
-    tap_client = TapPaymentsClient()
+    tap_client = TapPaymentsClient(http_client=tap_http_client)
 except Exception as e:
     print(f"⚠️ Tap Payments not available: {e}")
     TAP_ENABLED = False
@@ -3687,6 +4620,15 @@ SUBSCRIPTION_PLANS = {
     }
 }
 
+# The plan list is static, so it is serialized once and served with an ETag
+SUBSCRIPTION_PLANS_JSON = orjson.dumps({"success": True, "plans": SUBSCRIPTION_PLANS})
+SUBSCRIPTION_PLANS_ETAG = '"' + base64.urlsafe_b64encode(
+    hashlib.sha256(SUBSCRIPTION_PLANS_JSON).digest()
+).decode().rstrip("=") + '"'
+
+# Plans by key ("monthly") and by id ("premium_monthly"), so checkout resolves either form directly
+PLAN_LOOKUP = {**SUBSCRIPTION_PLANS, **{plan["id"]: plan for plan in SUBSCRIPTION_PLANS.values()}}
+
 class ChargeRequest(BaseModel):
     model_config = ConfigDict(extra="ignore")
     plan_id: str
@@ -3695,12 +4637,12 @@ class ChargeRequest(BaseModel):
     customer_email: str
 
 @api_router.get("/subscription-plans")
-async def get_subscription_plans():
+async def get_subscription_plans(if_none_match: Optional[str] = Header(None)):
     """Get available subscription plans"""
-    return {
-        "success": True,
-        "plans": SUBSCRIPTION_PLANS
-    }
+    headers = {"ETag": SUBSCRIPTION_PLANS_ETAG}
+    if if_none_match == SUBSCRIPTION_PLANS_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(content=SUBSCRIPTION_PLANS_JSON, media_type="application/json", headers=headers)
 
 @api_router.post("/create-checkout")
 async def create_checkout(
@@ -3712,73 +4654,58 @@ async def create_checkout(
     if not TAP_ENABLED:
         raise HTTPException(status_code=503, detail="Payment service unavailable")
     
-    import httpx
-    
     try:
+        now = datetime.now(timezone.utc)
+        
         # Get plan details
-        plan = SUBSCRIPTION_PLANS.get(plan_id.replace("premium_", ""))
+        plan = PLAN_LOOKUP.get(plan_id)
         if not plan:
             raise HTTPException(status_code=404, detail="Plan not found")
         
         # Get frontend URL for redirect
         frontend_url = os.environ.get('FRONTEND_URL', 'http://localhost:3000')
         
-        # Create checkout session via Tap API
-        payload = {
-            "amount": plan["amount"],
-            "currency": plan["currency"],
-            "customer_initiated": True,
-            "threeDSecure": True,
-            "save_card": False,
-            "description": f"PharmaPal {plan['name']} Subscription",
-            "metadata": {
+        # Create checkout session via Tap API. create_charge rounds the amount, retries
+        # transient failures and returns the first charge for a double-submitted checkout.
+        charge_result = await tap_client.create_charge(
+            amount=Decimal(str(plan["amount"])),
+            currency=plan["currency"],
+            source_id="src_all",
+            customer_name=current_user.get("full_name") or "User",
+            customer_email=current_user.get("email") or f"{current_user.get('phone', 'user')}@medtrack.local",
+            description=f"PharmaPal {plan['name']} Subscription",
+            redirect_url=f"{frontend_url}/payment-success",
+            metadata={
                 "user_id": current_user["id"],
                 "plan_id": plan_id,
                 "udf1": current_user.get("email", current_user.get("phone", ""))
             },
-            "reference": {
-                "transaction": f"txn_{current_user['id']}_{int(datetime.now(timezone.utc).timestamp())}",
-                "order": f"order_{current_user['id']}_{plan_id}"
-            },
-            "receipt": {
-                "email": True,
-                "sms": True
+            customer_phone={
+                "country_code": "966",
+                "number": current_user.get("phone", "5000000000").replace("+966", "").replace("966", "").lstrip("0")
             },
-            "customer": {
-                "first_name": current_user.get("full_name", "User").split()[0] if current_user.get("full_name") else "User",
-                "last_name": " ".join(current_user.get("full_name", "").split()[1:]) if current_user.get("full_name") and len(current_user.get("full_name", "").split()) > 1 else "",
-                "email": current_user.get("email") or f"{current_user.get('phone', 'user')}@medtrack.local",
-                "phone": {
-                    "country_code": "966",
-                    "number": current_user.get("phone", "5000000000").replace("+966", "").replace("966", "").lstrip("0")
+            extra={
+                "customer_initiated": True,
+                "threeDSecure": True,
+                "save_card": False,
+                "reference": {
+                    "transaction": f"txn_{current_user['id']}_{int(now.timestamp())}",
+                    "order": f"order_{current_user['id']}_{plan_id}"
+                },
+                "receipt": {
+                    "email": True,
+                    "sms": True
+                },
+                "merchant": {
+                    "id": ""
+                },
+                "post": {
+                    "url": f"{frontend_url}/payment-callback"
                 }
-            },
-            "merchant": {
-                "id": ""
-            },
-            "source": {
-                "id": "src_all"
-            },
-            "post": {
-                "url": f"{frontend_url}/payment-callback"
-            },
-            "redirect": {
-                "url": f"{frontend_url}/payment-success"
             }
-        }
-        
-        # Call Tap API to create charge
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{tap_client.base_url}/v2/charges",
-                json=payload,
-                headers=tap_client.headers,
-                timeout=30.0
-            )
-            response.raise_for_status()
-            charge_result = response.json()
+        )
         
-        # Store payment record
+        # Store payment record (once per charge, so a deduplicated double submit doesn't add a second)
         payment_record = {
             "id": str(uuid.uuid4()),
             "user_id": current_user["id"],
@@ -3788,9 +4715,13 @@ async def create_checkout(
             "currency": plan["currency"],
             "status": charge_result.get("status", "INITIATED"),
             "tap_response": charge_result,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": now.isoformat()
         }
-        await db.payments.insert_one(payment_record)
+        await db.payments.update_one(
+            {"charge_id": payment_record["charge_id"]},
+            {"$setOnInsert": payment_record},
+            upsert=True
+        )
         
         logger.info(f"Created checkout session {charge_result.get('id')} for user {current_user['id']}")
         
@@ -3807,15 +4738,27 @@ async def create_checkout(
             "status": charge_result.get("status")
         }
         
-    except httpx.HTTPError as e:
-        logger.error(f"Tap API error: {str(e)}")
-        if hasattr(e, 'response') and e.response is not None:
-            logger.error(f"Response: {e.response.text}")
-        raise HTTPException(status_code=400, detail=f"Payment initialization failed: {str(e)}")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Checkout creation error: {str(e)}")
         raise HTTPException(status_code=400, detail=f"Payment failed: {str(e)}")
 
+# Status polls for the same charge share one in-flight Tap request
+# (TapPaymentsClient caches the answers by charge status)
+tap_charge_inflight = {}
+
+async def fetch_tap_charge(charge_id: str) -> dict:
+    """Retrieve a Tap charge, coalescing concurrent lookups for the same id"""
+    task = tap_charge_inflight.get(charge_id)
+    if task is None:
+        task = asyncio.create_task(tap_client.retrieve_charge(charge_id))
+        tap_charge_inflight[charge_id] = task
+        task.add_done_callback(lambda _: tap_charge_inflight.pop(charge_id, None))
+    
+    # Shielded so one cancelled poll doesn't cancel the request the others are waiting on
+    return await asyncio.shield(task)
+
 @api_router.get("/payment-status/{charge_id}")
 async def get_payment_status(
     charge_id: str,
@@ -3827,43 +4770,53 @@ async def get_payment_status(
         raise HTTPException(status_code=503, detail="Payment service unavailable")
     
     try:
-        # Get charge from Tap
-        charge_data = await tap_client.retrieve_charge(charge_id)
-        
-        # Update payment record
-        payment = await db.payments.find_one({"charge_id": charge_id}, {"_id": 0})
+        # Get charge from Tap and our payment record concurrently
+        charge_data, payment = await asyncio.gather(
+            fetch_tap_charge(charge_id),
+            db.payments.find_one({"charge_id": charge_id}, {"_id": 0})
+        )
         
         if payment:
-            await db.payments.update_one(
-                {"charge_id": charge_id},
-                {"$set": {
-                    "status": charge_data.get("status"),
-                    "tap_response": charge_data,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
+            now = datetime.now(timezone.utc)
+            
+            # Update payment record
+            updates = [
+                db.payments.update_one(
+                    {"charge_id": charge_id},
+                    {"$set": {
+                        "status": charge_data.get("status"),
+                        "tap_response": charge_data,
+                        "updated_at": now.isoformat()
+                    }}
+                )
+            ]
             
             # If payment captured, activate premium
-            if charge_data.get("status") == "CAPTURED":
+            captured = charge_data.get("status") == "CAPTURED"
+            if captured:
                 plan_id = payment.get("plan_id", "")
                 
                 # Calculate expiry based on plan
-                now = datetime.now(timezone.utc)
                 if "monthly" in plan_id:
                     expiry = now + timedelta(days=30)
                 else:  # yearly
                     expiry = now + timedelta(days=365)
                 
                 # Update user premium status
-                await db.users.update_one(
+                updates.append(db.users.update_one(
                     {"id": current_user["id"]},
                     {"$set": {
                         "is_premium": True,
                         "premium_expires_at": expiry.isoformat(),
                         "premium_plan": plan_id
                     }}
-                )
-                
+                ))
+            
+            # The payment and user writes are independent, so issue them together
+            await asyncio.gather(*updates)
+            
+            if captured:
+                invalidate_cached_user(current_user["id"])
                 logger.info(f"Activated premium for user {current_user['id']}")
         
         return {
@@ -3901,6 +4854,7 @@ async def activate_premium_self(admin_user: dict = Depends(get_admin_user)):
                 }
             }
         )
+        invalidate_cached_user(admin_id)
         
         return {
             "success": True,
@@ -3913,18 +4867,9 @@ async def activate_premium_self(admin_user: dict = Depends(get_admin_user)):
 
 
 @api_router.get("/subscription/status")
-async def check_subscription_status(authorization: str = Header(None)):
+async def check_subscription_status(user: dict = Depends(get_current_user)):
     """Check if user's subscription is still valid"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user_data = verify_jwt_token(token)
-    user_id = user_data.get("user_id")
-    
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = user["id"]
     
     now = datetime.now(timezone.utc)
     
@@ -3934,7 +4879,8 @@ async def check_subscription_status(authorization: str = Header(None)):
     hours_remaining = 0
     
     if user.get("subscription_end_date"):
-        end_date = datetime.fromisoformat(user["subscription_end_date"].replace('Z', '+00:00'))
+        # Python 3.11's C fromisoformat accepts a trailing "Z" directly
+        end_date = datetime.fromisoformat(user["subscription_end_date"])
         time_remaining = end_date - now
         
         is_active = time_remaining.total_seconds() > 0
@@ -3947,6 +4893,7 @@ async def check_subscription_status(authorization: str = Header(None)):
                 {"id": user_id},
                 {"$set": {"trial_used": True}}
             )
+            invalidate_cached_user(user_id)
     
     return {
         "is_active": is_active,
@@ -3960,15 +4907,10 @@ async def check_subscription_status(authorization: str = Header(None)):
 @api_router.post("/subscription/upgrade")
 async def upgrade_subscription(
     tier: str,
-    authorization: str = Header(None)
+    current_user: dict = Depends(get_current_user)
 ):
     """Upgrade user subscription"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user_data = verify_jwt_token(token)
-    user_id = user_data.get("user_id")
+    user_id = current_user["id"]
     
     # Define subscription durations
     durations = {
@@ -3994,6 +4936,7 @@ async def upgrade_subscription(
             }
         }
     )
+    invalidate_cached_user(user_id)
     
     return {
         "success": True,
@@ -4002,35 +4945,35 @@ async def upgrade_subscription(
     }
 
 @api_router.delete("/account")
-async def delete_account(authorization: str = Header(None)):
+async def delete_account(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: dict = Depends(get_current_user)
+):
     """Delete user account - marks phone as used to prevent re-registration"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.replace("Bearer ", "")
-    user_data = verify_jwt_token(token)
-    user_id = user_data.get("user_id")
-    
-    user = await db.users.find_one({"id": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    user_id = current_user["id"]
     
-    # Mark account as deleted and keep trial_used status
-    await db.users.update_one(
+    # Mark account as deleted and keep trial_used status, in the same round trip as the existence check
+    result = await db.users.update_one(
         {"id": user_id},
-        {
-            "$set": {
+        [
+            {"$set": {
                 "account_deleted": True,
-                "trial_used": user.get("trial_used", False),
+                "trial_used": {"$ifNull": ["$trial_used", False]},
                 "deleted_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
+            }}
+        ]
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(user_id)
+    jwt_payload_cache.pop(credentials.credentials, None)
     
     # Delete user's medications and reminders
-    await db.user_medications.delete_many({"user_id": user_id})
-    await db.reminders.delete_many({"user_id": user_id})
-    await db.notifications.delete_many({"user_id": user_id})
+    await asyncio.gather(
+        db.user_medications.delete_many({"user_id": user_id}),
+        db.reminders.delete_many({"user_id": user_id}),
+        db.notifications.delete_many({"user_id": user_id})
+    )
     
     return {"success": True, "message": "Account deleted successfully"}
 
@@ -4038,74 +4981,35 @@ async def delete_account(authorization: str = Header(None)):
 # CONTACT US & EMAIL ENDPOINTS
 # ============================================
 
-class ContactEmailRequest(BaseModel):
-    """Model for contact form submission"""
-    subject: str
-    message: str
-    user_name: Optional[str] = None
-    user_phone: Optional[str] = None
-
-@api_router.post("/send-contact-email")
-async def send_contact_email(
-    contact_data: ContactEmailRequest,
-    current_user: dict = Depends(get_current_user)
-):
-    """Send contact form email to info@pharmapal.online"""
-    try:
-        if not EMAIL_ENABLED or not email_service.is_configured():
-            # Save to database as fallback
-            contact_message = {
-                "id": str(uuid.uuid4()),
-                "user_id": current_user["id"],
-                "user_name": current_user.get("full_name", ""),
-                "user_phone": current_user.get("phone", ""),
-                "subject": contact_data.subject,
-                "message": contact_data.message,
-                "status": "pending",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.contact_messages.insert_one(contact_message)
-            
-            return {
-                "success": True,
-                "message": "Message saved. Email service is not configured.",
-                "saved_to_db": True
-            }
-        
-        # Prepare email content
-        user_name = current_user.get("full_name", "مستخدم")
-        user_phone = current_user.get("phone", "غير متوفر")
-        
-        email_subject = f"رسالة من PharmaPal: {contact_data.subject}"
-        
-        email_body = f"""
+# Contact email bodies, parsed once at import and filled per message
+CONTACT_EMAIL_TEXT_TEMPLATE = Template("""
 رسالة جديدة من تطبيق PharmaPal
 
-نوع الرسالة: {contact_data.subject}
+نوع الرسالة: ${subject}
 
-من: {user_name}
-رقم الهاتف: {user_phone}
+من: ${user_name}
+رقم الهاتف: ${user_phone}
 
 الرسالة:
-{contact_data.message}
+${message}
 
 ---
-تم الإرسال في: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC
-"""
-        
-        html_body = f"""
+تم الإرسال في: ${sent_at} UTC
+""")
+
+CONTACT_EMAIL_HTML_TEMPLATE = Template("""
 <!DOCTYPE html>
 <html dir="rtl">
 <head>
     <meta charset="UTF-8">
     <style>
-        body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: linear-gradient(135deg, #10b981 0%, #14b8a6 100%); color: white; padding: 20px; border-radius: 10px 10px 0 0; }}
-        .content {{ background: #f9fafb; padding: 20px; border: 1px solid #e5e7eb; }}
-        .footer {{ background: #f3f4f6; padding: 15px; text-center; font-size: 12px; color: #6b7280; border-radius: 0 0 10px 10px; }}
-        .info-row {{ margin: 10px 0; padding: 10px; background: white; border-radius: 5px; }}
-        .label {{ font-weight: bold; color: #059669; }}
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #10b981 0%, #14b8a6 100%); color: white; padding: 20px; border-radius: 10px 10px 0 0; }
+        .content { background: #f9fafb; padding: 20px; border: 1px solid #e5e7eb; }
+        .footer { background: #f3f4f6; padding: 15px; text-center; font-size: 12px; color: #6b7280; border-radius: 0 0 10px 10px; }
+        .info-row { margin: 10px 0; padding: 10px; background: white; border-radius: 5px; }
+        .label { font-weight: bold; color: #059669; }
     </style>
 </head>
 <body>
@@ -4116,36 +5020,102 @@ async def send_contact_email(
         </div>
         <div class="content">
             <div class="info-row">
-                <span class="label">نوع الرسالة:</span> {contact_data.subject}
+                <span class="label">نوع الرسالة:</span> ${subject}
             </div>
             <div class="info-row">
-                <span class="label">من:</span> {user_name}
+                <span class="label">من:</span> ${user_name}
             </div>
             <div class="info-row">
-                <span class="label">رقم الهاتف:</span> {user_phone}
+                <span class="label">رقم الهاتف:</span> ${user_phone}
             </div>
             <div class="info-row">
                 <span class="label">الرسالة:</span>
-                <p style="margin-top: 10px; white-space: pre-wrap;">{contact_data.message}</p>
+                <p style="margin-top: 10px; white-space: pre-wrap;">${message}</p>
             </div>
         </div>
         <div class="footer">
-            تم الإرسال في: {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} UTC
+            تم الإرسال في: ${sent_at} UTC
         </div>
     </div>
 </body>
 </html>
-"""
-        
-        # Send email
-        success = email_service.send_email(
+""")
+
+class ContactEmailRequest(BaseModel):
+    """Model for contact form submission"""
+    subject: str
+    message: str
+    user_name: Optional[str] = None
+    user_phone: Optional[str] = None
+
+async def deliver_contact_email(message_id: str, subject: str, body: str, html_body: str):
+    """Send a queued contact email and record the outcome on its contact_messages entry"""
+    try:
+        # send_email uses blocking smtplib, so keep it off the event loop
+        success = await asyncio.to_thread(
+            email_service.send_email,
             to_email="info@pharmapal.online",
-            subject=email_subject,
-            body=email_body,
+            subject=subject,
+            body=body,
             html_body=html_body
         )
+    except Exception as e:
+        logger.error(f"Error delivering contact email {message_id}: {str(e)}")
+        success = False
+    
+    await db.contact_messages.update_one(
+        {"id": message_id},
+        {"$set": {"status": "sent" if success else "failed", "email_sent": success}}
+    )
+
+@api_router.post("/send-contact-email", status_code=202)
+async def send_contact_email(
+    contact_data: ContactEmailRequest,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """Send contact form email to info@pharmapal.online"""
+    try:
+        now = datetime.now(timezone.utc)
+        now_iso = now.isoformat()
+        
+        if not EMAIL_ENABLED or not email_service.is_configured():
+            # Save to database as fallback
+            contact_message = {
+                "id": str(uuid.uuid4()),
+                "user_id": current_user["id"],
+                "user_name": current_user.get("full_name", ""),
+                "user_phone": current_user.get("phone", ""),
+                "subject": contact_data.subject,
+                "message": contact_data.message,
+                "status": "pending",
+                "created_at": now_iso
+            }
+            await db.contact_messages.insert_one(contact_message)
+            
+            return {
+                "success": True,
+                "message": "Message saved. Email service is not configured.",
+                "saved_to_db": True
+            }
+        
+        # Prepare email content
+        user_name = current_user.get("full_name", "مستخدم")
+        user_phone = current_user.get("phone", "غير متوفر")
+        
+        email_subject = f"رسالة من PharmaPal: {contact_data.subject}"
+        
+        template_fields = {
+            "subject": contact_data.subject,
+            "message": contact_data.message,
+            "user_name": user_name,
+            "user_phone": user_phone,
+            "sent_at": now.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        email_body = CONTACT_EMAIL_TEXT_TEMPLATE.substitute(template_fields)
+        html_body = CONTACT_EMAIL_HTML_TEMPLATE.substitute(template_fields)
         
-        # Save to database regardless of email success
+        # Record the message first so it survives a crash before delivery
         contact_message = {
             "id": str(uuid.uuid4()),
             "user_id": current_user["id"],
@@ -4153,25 +5123,22 @@ async def send_contact_email(
             "user_phone": user_phone,
             "subject": contact_data.subject,
             "message": contact_data.message,
-            "status": "sent" if success else "failed",
-            "email_sent": success,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "status": "queued",
+            "email_sent": False,
+            "created_at": now_iso
         }
         await db.contact_messages.insert_one(contact_message)
         
-        if success:
-            return {
-                "success": True,
-                "message": "Email sent successfully",
-                "email_sent": True
-            }
-        else:
-            return {
-                "success": False,
-                "message": "Failed to send email, but message was saved",
-                "email_sent": False,
-                "saved_to_db": True
-            }
+        # SMTP delivery happens after the response is sent
+        background_tasks.add_task(
+            deliver_contact_email, contact_message["id"], email_subject, email_body, html_body
+        )
+        
+        return {
+            "success": True,
+            "message": "Message received and queued for delivery",
+            "queued": True
+        }
             
     except Exception as e:
         logger.error(f"Error in send_contact_email: {str(e)}")
@@ -4196,43 +5163,32 @@ async def broadcast_notification(
         if not title or not body:
             raise HTTPException(status_code=400, detail="Title and body are required")
         
-        # Get all users
-        users = await db.users.find({}, {"id": 1, "_id": 0}).to_list(length=None)
-        
         # Create notifications for all users
-        notifications = []
-        for user in users:
-            notification = {
-                "id": str(uuid.uuid4()),
-                "user_id": user["id"],
-                "title": title,
-                "body": body,
-                "type": notification_type,
-                "read": False,
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            notifications.append(notification)
-        
-        if notifications:
-            await db.notifications.insert_many(notifications)
+        sent_count = await insert_notifications_for_users({}, title, body, notification_type)
         
         # If Firebase is enabled, send push notifications
         if FIREBASE_ENABLED:
             try:
-                # Get all FCM tokens
-                tokens_cursor = db.fcm_tokens.find({}, {"token": 1, "_id": 0})
-                tokens = await tokens_cursor.to_list(length=None)
-                fcm_tokens = [t["token"] for t in tokens if t.get("token")]
+                # Stream FCM tokens and push them in multicast-sized batches
+                pushed = 0
+                fcm_tokens = []
+                async for t in db.fcm_tokens.find({}, {"token": 1, "_id": 0}).batch_size(FCM_MULTICAST_LIMIT):
+                    if t.get("token"):
+                        fcm_tokens.append(t["token"])
+                    if len(fcm_tokens) >= FCM_MULTICAST_LIMIT:
+                        pushed += await asyncio.to_thread(send_multicast_notification, fcm_tokens, title, body)
+                        fcm_tokens = []
                 
                 if fcm_tokens:
-                    pass
+                    pushed += await asyncio.to_thread(send_multicast_notification, fcm_tokens, title, body)
+                logger.info(f"Broadcast push delivered to {pushed} devices")
             except Exception as e:
                 logger.warning(f"Failed to send push notifications: {e}")
         
         return {
             "success": True,
-            "message": f"Notification sent to {len(notifications)} users",
-            "count": len(notifications)
+            "message": f"Notification sent to {sent_count} users",
+            "count": sent_count
         }
         
     except HTTPException:
@@ -4311,23 +5267,29 @@ async def get_multi_source_dosage(
 async def get_notification_stats(admin_user: dict = Depends(get_admin_user)):
     """Get notification statistics"""
     try:
-        total_sent = await db.notifications.count_documents({})
-        total_read = await db.notifications.count_documents({"read": True})
-        total_unread = await db.notifications.count_documents({"read": False})
-        
-        # Get recent notifications
-        recent_notifications = await db.notifications.find(
-            {},
-            {"_id": 0}
-        ).sort("created_at", -1).limit(20).to_list(length=20)
+        # Read/unread counts in one pass over the read index, alongside the recent list
+        read_counts, recent_notifications = await asyncio.gather(
+            db.notifications.aggregate([
+                {"$group": {"_id": "$read", "count": {"$sum": 1}}}
+            ]).to_list(length=None),
+            db.notifications.find(
+                {},
+                {"_id": 0}
+            ).sort("created_at", -1).limit(20).to_list(length=20)
+        )
+        counts = {row["_id"]: row["count"] for row in read_counts}
+        total_read = counts.get(True, 0)
+        total_unread = counts.get(False, 0)
+        total_sent = sum(counts.values())
         
-        return {
+        # Plain Mongo documents: serialize directly, skipping FastAPI's jsonable_encoder pass
+        return ORJSONResponse({
             "success": True,
             "total_sent": total_sent,
             "total_read": total_read,
             "total_unread": total_unread,
             "recent_notifications": recent_notifications
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error getting notification stats: {str(e)}")
@@ -4340,6 +5302,8 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paged medication lists point at their next page in Link
+    expose_headers=["Link"],
 )
 
 # Configure logging
@@ -4358,6 +5322,24 @@ app.include_router(api_router)
 @app.on_event("startup")
 async def startup_event():
     await init_sfda_database()
+    await ensure_indexes()
+    await build_interaction_pairs()
+    
+    # Keep interaction pairs in step with catalog imports
+    global interaction_pairs_refresher_task
+    interaction_pairs_refresher_task = asyncio.create_task(interaction_pairs_refresher())
+    
+    # Start orphan reminder cleanup in the background
+    global orphan_reminder_reaper_task
+    orphan_reminder_reaper_task = asyncio.create_task(orphan_reminder_reaper())
+    
+    # Start persisting free-user SFDA search counts
+    global sfda_search_flusher_task
+    sfda_search_flusher_task = asyncio.create_task(sfda_search_flusher())
+    
+    # Start refreshing the materialized admin dashboard
+    global admin_dashboard_refresher_task
+    admin_dashboard_refresher_task = asyncio.create_task(admin_dashboard_refresher())
     
     # Create admin account if it doesn't exist
     # Read from environment variables with fallbacks for development
@@ -4369,7 +5351,8 @@ async def startup_event():
     if admin_password == "PharmaAdmin2025!" and os.environ.get('ENVIRONMENT') == 'production':
         logger.warning("⚠️ Using default admin password in production! Please set ADMIN_PASSWORD environment variable.")
     
-    existing_admin = await db.users.find_one({"email": admin_email})
+    # Indexed existence check first: building the admin document costs a bcrypt hash
+    existing_admin = await db.users.find_one({"email": admin_email}, {"_id": 1})
     if not existing_admin:
         admin_user = {
             "id": str(uuid.uuid4()),
@@ -4393,10 +5376,21 @@ async def startup_event():
             "trial_used": False,
             "account_deleted": False,
             "last_login": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         }
-        await db.users.insert_one(admin_user)
-        logger.info(f"Admin account created: {admin_email} / {admin_phone}")
+        # Upsert on the unique email index so several workers booting at once can't each insert an admin
+        try:
+            result = await db.users.update_one(
+                {"email": admin_email},
+                {"$setOnInsert": admin_user},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            result = None
+        if result is not None and result.upserted_id is not None:
+            logger.info(f"Admin account created: {admin_email} / {admin_phone}")
+        else:
+            logger.info("Admin account already exists")
     else:
         logger.info("Admin account already exists")
     
@@ -4411,6 +5405,26 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Stop orphan reminder reaper
+    if orphan_reminder_reaper_task:
+        orphan_reminder_reaper_task.cancel()
+    
+    # Stop the SFDA search count flusher and write what is still queued
+    if sfda_search_flusher_task:
+        sfda_search_flusher_task.cancel()
+    await flush_sfda_search_counts()
+    
+    if admin_dashboard_refresher_task:
+        admin_dashboard_refresher_task.cancel()
+    
+    if interaction_pairs_refresher_task:
+        interaction_pairs_refresher_task.cancel()
+    
+    await fda_client.aclose()
+    if tap_client:
+        await tap_client.aclose()
+    await tap_http_client.aclose()
+    
     # Stop scheduler
     if SCHEDULER_ENABLED:
         stop_scheduler()
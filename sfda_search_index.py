@@ -0,0 +1,31 @@
+"""
+Weighted SFDA search text index shared by the API and the SFDA import scripts
+"""
+
+# Fields matched by /sfda-medications/search, and their text-index weights
+SFDA_SEARCH_FIELDS = [
+    "trade_name", "trade_name_ar", "commercial_name_en", "commercial_name_ar",
+    "scientific_name", "scientific_name_ar", "active_ingredients", "manufacturer", "manufacturer_ar"
+]
+SFDA_SEARCH_WEIGHTS = {
+    "trade_name": 10, "trade_name_ar": 10, "commercial_name_en": 10, "commercial_name_ar": 10,
+    "scientific_name": 5, "scientific_name_ar": 5, "active_ingredients": 5,
+    "manufacturer": 1, "manufacturer_ar": 1
+}
+SFDA_SEARCH_TEXT_INDEX_NAME = "sfda_search_text"
+
+async def ensure_sfda_search_text_index(collection):
+    """Create the weighted SFDA search text index, replacing any older text index on the collection"""
+    # A collection can only have one text index (import scripts used to create a narrower one)
+    indexes = await collection.index_information()
+    for name, info in indexes.items():
+        if name != SFDA_SEARCH_TEXT_INDEX_NAME and any(kind == "text" for _, kind in info["key"]):
+            await collection.drop_index(name)
+    
+    # Language "none" so Arabic and English are tokenized alike
+    await collection.create_index(
+        [(field, "text") for field in SFDA_SEARCH_FIELDS],
+        weights=SFDA_SEARCH_WEIGHTS,
+        default_language="none",
+        name=SFDA_SEARCH_TEXT_INDEX_NAME
+    )
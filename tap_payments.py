@@ -1,19 +1,127 @@
+import asyncio
+import hashlib
 import httpx
 import logging
-from typing import Dict, Any, Optional
-from decimal import Decimal
+import orjson
+import random
+from typing import Dict, Any, List, Optional, Union
+from decimal import Decimal, ROUND_HALF_UP
+from cachetools import TTLCache
 import os
 
 logger = logging.getLogger(__name__)
 
+# Charges in these states never change again, so they can be cached for much longer
+TERMINAL_CHARGE_STATUSES = frozenset({
+    "CAPTURED", "FAILED", "VOID", "DECLINED", "CANCELLED", "ABANDONED", "RESTRICTED", "TIMEDOUT"
+})
+PENDING_CHARGE_CACHE_TTL_SECONDS = 5
+TERMINAL_CHARGE_CACHE_TTL_SECONDS = 3600
+# Rounding quantum per currency (Tap takes amounts in major units at the currency's minor precision)
+CURRENCY_QUANTUMS = {
+    "KWD": Decimal("0.001"),
+    "BHD": Decimal("0.001"),
+    "OMR": Decimal("0.001"),
+    "JOD": Decimal("0.001"),
+    "SAR": Decimal("0.01"),
+    "AED": Decimal("0.01"),
+    "QAR": Decimal("0.01"),
+    "EGP": Decimal("0.01"),
+    "USD": Decimal("0.01"),
+    "EUR": Decimal("0.01"),
+    "GBP": Decimal("0.01"),
+}
+DEFAULT_CURRENCY_QUANTUM = Decimal("0.01")
+
+# Retries for transient Tap failures: attempts in total, base delay doubling per attempt, cap on waits
+TAP_MAX_ATTEMPTS = 3
+TAP_RETRY_BASE_DELAY_SECONDS = 0.1
+TAP_RETRY_MAX_DELAY_SECONDS = 2.0
+# Reads are safe to repeat on any transient failure
+RETRYABLE_READ_STATUSES = frozenset({429, 500, 502, 503, 504})
+RETRYABLE_READ_ERRORS = (httpx.TransportError,)
+# A charge POST is only repeated when Tap certainly never processed it, so a retry can't double-bill
+RETRYABLE_CHARGE_STATUSES = frozenset({429})
+RETRYABLE_CHARGE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Identical charge submissions within this window (double clicks, client retries) reuse the first charge
+DUPLICATE_CHARGE_WINDOW_SECONDS = 60
+
+# Upper bound on concurrent Tap requests from one batch retrieval, to stay under Tap's rate limits
+MAX_CONCURRENT_CHARGE_RETRIEVALS = 20
+
 class TapPaymentsClient:
-    def __init__(self):
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        # Long-lived client so calls reuse keep-alive connections; callers may pass their own
+        self.http_client = http_client
+        self._owns_client = http_client is None
         self.base_url = os.environ.get('TAP_API_BASE_URL', 'https://api.tap.company')
         self.secret_key = os.environ.get('TAP_SECRET_KEY')
-        self.headers = {
+        if not self.secret_key:
+            raise ValueError("TAP_SECRET_KEY is not set")
+        # Normalized once; an owned client carries them, a shared one gets them per request
+        self.headers = httpx.Headers({
             "Authorization": f"Bearer {self.secret_key}",
             "Content-Type": "application/json"
-        }
+        })
+        # retrieve_charge results by charge id; pending ones expire quickly, final ones last an hour
+        self._pending_charges = TTLCache(maxsize=2048, ttl=PENDING_CHARGE_CACHE_TTL_SECONDS)
+        self._terminal_charges = TTLCache(maxsize=10000, ttl=TERMINAL_CHARGE_CACHE_TTL_SECONDS)
+        # Last answer seen per charge, served if Tap itself fails (5xx)
+        self._last_known_charges = TTLCache(maxsize=10000, ttl=TERMINAL_CHARGE_CACHE_TTL_SECONDS)
+        # create_charge results and in-flight POSTs by submission fingerprint
+        self._recent_charges = TTLCache(maxsize=4096, ttl=DUPLICATE_CHARGE_WINDOW_SECONDS)
+        self._charges_in_flight = {}
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared client, created on first use so no event loop is needed at import"""
+        if self.http_client is None:
+            # Single origin: HTTP/2 multiplexes concurrent calls over a handful of connections.
+            # A 60s idle window keeps them open between bursts so checkouts skip the TLS handshake.
+            self.http_client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=30.0,
+                http2=True,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=5, keepalive_expiry=60)
+            )
+        return self.http_client
+    
+    async def _request_with_retry(
+        self,
+        method: str,
+        url: str,
+        retry_statuses: frozenset,
+        retry_errors: tuple,
+        **kwargs
+    ) -> httpx.Response:
+        """Send a request, retrying transient failures with jittered exponential backoff"""
+        if not self._owns_client:
+            kwargs["headers"] = self.headers
+        for attempt in range(TAP_MAX_ATTEMPTS):
+            last_attempt = attempt == TAP_MAX_ATTEMPTS - 1
+            try:
+                response = await self._get_client().request(method, url, **kwargs)
+            except retry_errors as e:
+                if last_attempt:
+                    raise
+                logger.warning("Tap %s %s failed (%s), retrying", method, url, e.__class__.__name__)
+                delay = None
+            else:
+                if response.status_code not in retry_statuses or last_attempt:
+                    return response
+                logger.warning("Tap %s %s returned %s, retrying", method, url, response.status_code)
+                retry_after = response.headers.get("Retry-After", "")
+                delay = float(retry_after) if retry_after.isdigit() else None
+            
+            if delay is None:
+                delay = TAP_RETRY_BASE_DELAY_SECONDS * (2 ** attempt) + random.uniform(0, TAP_RETRY_BASE_DELAY_SECONDS / 2)
+            await asyncio.sleep(min(delay, TAP_RETRY_MAX_DELAY_SECONDS))
+    
+    async def aclose(self):
+        """Close the HTTP client if this instance created it"""
+        if self._owns_client and self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
     
     async def create_charge(
         self,
@@ -24,17 +132,27 @@ class TapPaymentsClient:
         customer_email: str,
         description: str,
         redirect_url: str,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        customer_phone: Optional[Dict[str, str]] = None,
+        extra: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
-        """Create a charge using Tap Payments API"""
+        """Create a charge using Tap Payments API (extra holds any further top-level charge fields)"""
+        
+        name_parts = customer_name.split() if customer_name else []
+        first_name = name_parts[0] if name_parts else ""
+        last_name = " ".join(name_parts[1:])
+        
+        # Round once at the API boundary so the wire value is exactly what the currency can bill
+        quantum = CURRENCY_QUANTUMS.get(currency.upper(), DEFAULT_CURRENCY_QUANTUM)
+        billed_amount = Decimal(amount).quantize(quantum, rounding=ROUND_HALF_UP)
         
         payload = {
-            "amount": float(amount),
+            "amount": float(billed_amount),
             "currency": currency,
             "description": description,
             "customer": {
-                "first_name": customer_name.split()[0] if customer_name else "",
-                "last_name": " ".join(customer_name.split()[1:]) if len(customer_name.split()) > 1 else "",
+                "first_name": first_name,
+                "last_name": last_name,
                 "email": customer_email
             },
             "source": {
@@ -45,35 +163,104 @@ class TapPaymentsClient:
             },
             "metadata": metadata or {}
         }
+        if customer_phone:
+            payload["customer"]["phone"] = customer_phone
+        if extra:
+            payload.update(extra)
+        
+        # Same card source, amount, currency and customer within the window is a double submit
+        fingerprint = hashlib.blake2b(
+            f"{source_id}|{billed_amount}|{currency}|{customer_email}".encode(),
+            digest_size=16
+        ).hexdigest()
+        charge = self._recent_charges.get(fingerprint)
+        if charge is not None:
+            logger.info("Duplicate charge submission, returning charge %s", charge.get("id"))
+            return dict(charge)
+        
+        task = self._charges_in_flight.get(fingerprint)
+        if task is None:
+            task = asyncio.create_task(self._post_charge(payload))
+            self._charges_in_flight[fingerprint] = task
+            task.add_done_callback(lambda _: self._charges_in_flight.pop(fingerprint, None))
         
+        # Shielded so a cancelled duplicate doesn't abort the POST the first caller is waiting on
+        charge = await asyncio.shield(task)
+        self._recent_charges[fingerprint] = charge
+        # Every caller shares the cached dict, so never hand out the instance itself
+        return dict(charge)
+    
+    async def _post_charge(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a charge payload to Tap"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/v2/charges",
-                    json=payload,
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
+            # orjson encodes the body; self.headers already sets Content-Type: application/json
+            response = await self._request_with_retry(
+                "POST",
+                f"{self.base_url}/v2/charges",
+                RETRYABLE_CHARGE_STATUSES,
+                RETRYABLE_CHARGE_ERRORS,
+                content=orjson.dumps(payload),
+                timeout=30.0
+            )
+            logger.debug("Tap create_charge over %s", response.http_version)
+            response.raise_for_status()
+            return orjson.loads(response.content)
         except httpx.HTTPError as e:
-            logger.error(f"Tap API error creating charge: {str(e)}")
-            if hasattr(e, 'response') and e.response is not None:
-                logger.error(f"Response: {e.response.text}")
+            logger.error("Tap API error creating charge: %s", e, exc_info=True)
+            # Only decode the error body when it will actually be logged
+            response = getattr(e, "response", None)
+            if response is not None and logger.isEnabledFor(logging.ERROR):
+                logger.error("Response: %s", response.text)
             raise Exception(f"Payment processing failed: {str(e)}")
     
     async def retrieve_charge(self, charge_id: str) -> Dict[str, Any]:
         """Retrieve charge details"""
         
+        cached = self._terminal_charges.get(charge_id) or self._pending_charges.get(charge_id)
+        if cached is not None:
+            logger.debug("Tap charge cache hit: %s", charge_id)
+            return dict(cached)
+        logger.debug("Tap charge cache miss: %s", charge_id)
+        
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/v2/charges/{charge_id}",
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                return response.json()
+            response = await self._request_with_retry(
+                "GET",
+                f"{self.base_url}/v2/charges/{charge_id}",
+                RETRYABLE_READ_STATUSES,
+                RETRYABLE_READ_ERRORS,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            # Parse straight from the body bytes, skipping the str decode response.json() does
+            charge = orjson.loads(response.content)
         except httpx.HTTPError as e:
-            logger.error(f"Tap API error retrieving charge: {str(e)}")
+            stale = self._last_known_charges.get(charge_id)
+            if (
+                stale is not None
+                and isinstance(e, httpx.HTTPStatusError)
+                and e.response.status_code >= 500
+            ):
+                logger.warning("Tap API error retrieving charge, serving last known status: %s", e)
+                return dict(stale)
+            logger.error("Tap API error retrieving charge: %s", e, exc_info=True)
             raise Exception(f"Could not retrieve charge status: {str(e)}")
+        
+        if charge.get("status") in TERMINAL_CHARGE_STATUSES:
+            self._terminal_charges[charge_id] = charge
+        else:
+            self._pending_charges[charge_id] = charge
+        self._last_known_charges[charge_id] = charge
+        return dict(charge)
+    
+    async def retrieve_charges(self, charge_ids: List[str]) -> List[Union[Dict[str, Any], Exception]]:
+        """Retrieve several charges concurrently; failed lookups come back as exceptions in place"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHARGE_RETRIEVALS)
+        
+        async def retrieve_one(charge_id: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.retrieve_charge(charge_id)
+        
+        return await asyncio.gather(
+            *(retrieve_one(charge_id) for charge_id in charge_ids),
+            return_exceptions=True
+        )